@@ -1,10 +1,19 @@
 from flask import Blueprint, jsonify, request, Response, stream_with_context
 from app.services.agent_service import AgentService
 from app.services.llm_service import LLMService
-import json
+import orjson
 
 chat_bp = Blueprint('chat', __name__)
 
+# SSE 帧前后缀（预编码的 bytes）
+_SSE_PREFIX = b"data: "
+_SSE_SUFFIX = b"\n\n"
+
+
+def _sse_frame(payload: dict) -> bytes:
+    """将事件编码为一帧 SSE（orjson 直接输出 UTF-8 bytes，OCR 结果中可能带有 numpy 数值）"""
+    return b"".join((_SSE_PREFIX, orjson.dumps(payload, option=orjson.OPT_SERIALIZE_NUMPY), _SSE_SUFFIX))
+
 # 服务实例
 agent_service = AgentService()
 llm_service = LLMService()
@@ -12,8 +21,10 @@ llm_service = LLMService()
 
 @chat_bp.route('/stop', methods=['POST'])
 def stop_execution():
-    """停止当前任务执行"""
-    agent_service.stop()
+    """停止任务执行（传入 session_id 停止指定任务，不传则停止所有任务）"""
+    data = request.get_json(silent=True) or {}
+    if not agent_service.stop(data.get('session_id')):
+        return jsonify({'success': False, 'message': '任务不存在或已结束'}), 404
     return jsonify({'success': True, 'message': '已发送停止信号'})
 
 
@@ -33,9 +44,9 @@ def execute_task():
     def generate():
         try:
             for step_result in agent_service.execute_task(task):
-                yield f"data: {json.dumps(step_result, ensure_ascii=False)}\n\n"
+                yield _sse_frame(step_result)
         except Exception as e:
-            yield f"data: {json.dumps({'type': 'error', 'message': str(e)}, ensure_ascii=False)}\n\n"
+            yield _sse_frame({'type': 'error', 'message': str(e)})
     
     return Response(
         stream_with_context(generate()),
@@ -72,6 +83,8 @@ def get_history():
 def clear_history():
     """清空对话历史"""
     llm_service.clear_history()
+    llm_service.clear_response_cache()
+    agent_service.clear_plan_cache()
     return jsonify({'success': True, 'message': '对话历史已清空'})
 
 
@@ -84,7 +97,10 @@ def get_settings():
             'max_steps': agent_service.max_steps,
             'action_delay': agent_service.action_delay,
             'skip_ui_hierarchy': agent_service.skip_ui_hierarchy,
-            'parallel_enabled': agent_service.parallel_enabled
+            'parallel_enabled': agent_service.parallel_enabled,
+            'screenshot_scale': agent_service.screenshot_scale,
+            'screenshot_quality': agent_service.screenshot_quality,
+            'plan_cache_enabled': agent_service.plan_cache_enabled
         }
     })
 
@@ -102,6 +118,12 @@ def update_settings():
         agent_service.skip_ui_hierarchy = bool(data['skip_ui_hierarchy'])
     if 'parallel_enabled' in data:
         agent_service.parallel_enabled = bool(data['parallel_enabled'])
+    if 'screenshot_scale' in data:
+        agent_service.screenshot_scale = min(max(float(data['screenshot_scale']), 0.1), 1.0)
+    if 'screenshot_quality' in data:
+        agent_service.screenshot_quality = min(max(int(data['screenshot_quality']), 1), 95)
+    if 'plan_cache_enabled' in data:
+        agent_service.plan_cache_enabled = bool(data['plan_cache_enabled'])
     
     return jsonify({
         'success': True,
@@ -110,6 +132,9 @@ def update_settings():
             'max_steps': agent_service.max_steps,
             'action_delay': agent_service.action_delay,
             'skip_ui_hierarchy': agent_service.skip_ui_hierarchy,
-            'parallel_enabled': agent_service.parallel_enabled
+            'parallel_enabled': agent_service.parallel_enabled,
+            'screenshot_scale': agent_service.screenshot_scale,
+            'screenshot_quality': agent_service.screenshot_quality,
+            'plan_cache_enabled': agent_service.plan_cache_enabled
         }
     })
\ No newline at end of file
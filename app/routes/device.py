@@ -1,4 +1,5 @@
-from flask import Blueprint, jsonify, request
+from io import BytesIO
+from flask import Blueprint, jsonify, request, send_file
 from app.services.device_service import DeviceService
 from app.services.wireless_service import WirelessService
 
@@ -44,14 +45,33 @@ def disconnect_device():
 
 @device_bp.route('/screenshot', methods=['GET'])
 def get_screenshot():
-    """获取设备截图"""
+    """
+    获取设备截图
+    
+    默认返回 base64 data URI 的 JSON；format=raw 时直接返回图片二进制，省去 base64 编码
+    """
     try:
+        if request.args.get('format') == 'raw':
+            data, mimetype = device_service.get_screenshot_raw()
+            return send_file(BytesIO(data), mimetype=mimetype, max_age=0)
         screenshot_base64 = device_service.get_screenshot()
         return jsonify({'success': True, 'data': screenshot_base64})
     except Exception as e:
         return jsonify({'success': False, 'message': str(e)}), 500
 
 
+@device_bp.route('/screenshot/<screenshot_id>', methods=['GET'])
+def get_cached_screenshot(screenshot_id):
+    """按 ID 获取 Agent 执行过程中推送的截图"""
+    cached = device_service.get_cached_screenshot(screenshot_id)
+    if cached is None:
+        return jsonify({'success': False, 'message': '截图不存在或已过期'}), 404
+    
+    data, mimetype = cached
+    # ID 为内容哈希，同一 ID 的内容不会变化，可以让浏览器缓存
+    return send_file(BytesIO(data), mimetype=mimetype, max_age=3600)
+
+
 @device_bp.route('/info', methods=['GET'])
 def get_device_info():
     """获取设备信息"""
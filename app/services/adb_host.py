@@ -0,0 +1,74 @@
+import os
+import socket
+from typing import Optional
+
+
+# adb server 默认监听地址（与 adb 客户端一致，可通过 ANDROID_ADB_SERVER_PORT 修改端口）
+ADB_SERVER_HOST = '127.0.0.1'
+ADB_SERVER_PORT = int(os.getenv('ANDROID_ADB_SERVER_PORT') or 5037)
+
+
+class AdbHostError(Exception):
+    """adb server 返回 FAIL"""
+
+
+def _recv_exact(sock: socket.socket, size: int) -> bytes:
+    """读取指定长度的数据"""
+    chunks = []
+    while size > 0:
+        chunk = sock.recv(size)
+        if not chunk:
+            raise ConnectionError('adb server 连接已关闭')
+        chunks.append(chunk)
+        size -= len(chunk)
+    return b''.join(chunks)
+
+
+def _recv_string(sock: socket.socket) -> str:
+    """读取 4 位十六进制长度前缀的字符串"""
+    length = int(_recv_exact(sock, 4), 16)
+    return _recv_exact(sock, length).decode('utf-8', errors='replace')
+
+
+def host_request(service: str, timeout: float = 5.0) -> str:
+    """
+    直接通过 socket 向 adb server 发送 host 服务请求，省去启动 adb 客户端进程
+
+    Args:
+        service: host 服务，例如 'host:devices'、'host:connect:IP:PORT'
+        timeout: 超时时间（秒）
+
+    Returns:
+        adb server 返回的字符串
+
+    Raises:
+        OSError: adb server 未启动或连接失败
+        AdbHostError: adb server 返回 FAIL
+    """
+    request = service.encode('utf-8')
+    with socket.create_connection((ADB_SERVER_HOST, ADB_SERVER_PORT), timeout=timeout) as sock:
+        sock.sendall(b'%04x%s' % (len(request), request))
+        status = _recv_exact(sock, 4)
+        if status != b'OKAY':
+            raise AdbHostError(_recv_string(sock))
+        return _recv_string(sock)
+
+
+def list_devices(timeout: float = 5.0) -> Optional[list]:
+    """
+    获取 adb server 已知的设备列表
+
+    Returns:
+        [(serial, state), ...]；adb server 不可用时返回 None
+    """
+    try:
+        output = host_request('host:devices', timeout)
+    except (OSError, AdbHostError, ValueError):
+        return None
+
+    devices = []
+    for line in output.splitlines():
+        serial, sep, state = line.partition('\t')
+        if sep:
+            devices.append((serial.strip(), state.strip()))
+    return devices
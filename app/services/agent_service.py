@@ -1,71 +1,190 @@
+import os
 import time
+import uuid
+import atexit
+import threading
+import multiprocessing
 import concurrent.futures
-from typing import Dict, Any, Generator, List, Optional
+from collections import OrderedDict, deque
+from dataclasses import dataclass
+from types import MappingProxyType
+from typing import AbstractSet, Dict, Any, FrozenSet, Generator, List, Optional
 from app.services.device_service import DeviceService
 from app.services.llm_service import LLMService
-from app.services.ocr_service import ocr_service
+from app.services.ocr_service import (
+    ocr_service, init_ocr_process, ocr_process_ping, ocr_process_get_all_text_with_positions
+)
+from app.services.cache_service import CacheService
+from config import Config
+
+
+# 连续同方向滑动内容不变时的页面边界提示（按滑动方向）
+_BOUNDARY_MSGS = MappingProxyType({
+    'up': "【注意】页面已经到达底部，继续向上滑动无效。如需查找更多内容，请尝试向下滑动（回到顶部方向）。",
+    'down': "【注意】页面已经到达顶部，继续向下滑动无效。如需查找更多内容，请尝试向上滑动（向底部方向）。",
+    'left': "【注意】页面已经到达最右侧，继续向左滑动无效。请尝试向右滑动。",
+    'right': "【注意】页面已经到达最左侧，继续向右滑动无效。请尝试向左滑动。",
+})
+
+
+# 非关键事件：暂存起来，随下一个关键事件合并为一帧 {'type': 'step', 'events': [...]} 推送
+_DEFERRABLE_EVENT_TYPES = frozenset({'info', 'done', 'warning'})
+
+
+@dataclass
+class AgentSession:
+    """Agent 任务会话（每次执行任务独立的停止标志和滑动检测状态）"""
+    session_id: str
+    task: str
+    stop_flag: bool = False
+    last_ocr_texts: Optional[FrozenSet[str]] = None  # 上一次的OCR文字集合
+    last_swipe_direction: Optional[str] = None  # 上一次滑动方向
+    same_content_swipe_count: int = 0  # 连续滑动内容不变的次数
+    page_boundary_info: Optional[str] = None  # 页面边界信息
 
 
 class AgentService:
     """
     Agent服务 - 自动循环执行任务
+    服务本身为单例（共享设备、线程池和缓存），每次执行任务的状态保存在独立的 AgentSession 中
     """
     
     _instance = None
     
+    # OCR 结果缓存条数（按截图内容哈希索引，画面不变时直接复用）
+    OCR_CACHE_SIZE = 16
+    
+    # 单个任务保留的最近操作历史条数和记忆条数
+    ACTION_HISTORY_SIZE = 10
+    MEMORY_SIZE = 30
+    
+    # 滑动后屏幕文字相似度超过该值视为内容没有变化
+    SWIPE_SIMILARITY_THRESHOLD = 0.9
+    
+    # 执行计划缓存：成功完成的任务记录每步操作，再次执行相同任务时按步复用
+    PLAN_CACHE_NAMESPACE = 'task_plan'
+    PLAN_MATCH_THRESHOLD = 0.9  # 当前屏幕文字与记录时的相似度阈值
+    
     def __new__(cls):
         if cls._instance is None:
             cls._instance = super().__new__(cls)
-            cls._instance._stop_flag = False
-            cls._instance._ocr_service = None
+            cls._instance._initialized = False
+            cls._instance._ocr_service = None  # 后台预加载完成后首次使用时取出
+            cls._instance._sessions = {}  # session_id -> AgentSession
+            cls._instance._sessions_lock = threading.Lock()
+            cls._instance._ocr_cache = OrderedDict()
+            cls._instance._ocr_cache_lock = threading.Lock()
+            # 常驻线程池：截图、UI 层级、应用信息并行获取
+            cls._instance._pool = concurrent.futures.ThreadPoolExecutor(
+                max_workers=3, thread_name_prefix='agent'
+            )
+            # OCR 专用单线程 worker：PaddleOCR 推理非线程安全，多个任务的 OCR 在此排队串行
+            cls._instance._ocr_executor = concurrent.futures.ThreadPoolExecutor(
+                max_workers=1, thread_name_prefix='agent-ocr'
+            )
+            # 可选：OCR 放到独立子进程中执行（环境变量 OCR_USE_PROCESS=True）
+            cls._instance._ocr_process_pool = None
+            # 后台预加载 OCR 模型，首个任务不再承担模型加载耗时
+            # spawn 出的 OCR 子进程会重新导入应用模块，子进程中不预加载、不再创建子进程
+            # 调试模式下 Werkzeug 重载器的父进程只监视文件、不处理请求，同样不预加载
+            cls._instance._ocr_ready = None
+            if multiprocessing.parent_process() is None and not cls._is_reloader_parent():
+                if Config.OCR_USE_PROCESS:
+                    cls._instance._ocr_process_pool = concurrent.futures.ProcessPoolExecutor(
+                        max_workers=1, mp_context=multiprocessing.get_context('spawn'),
+                        initializer=init_ocr_process
+                    )
+                    cls._instance._ocr_process_pool.submit(ocr_process_ping)
+                else:
+                    cls._instance._ocr_ready = cls._instance._ocr_executor.submit(ocr_service)
+            atexit.register(cls._instance.shutdown)
         return cls._instance
     
+    @staticmethod
+    def _is_reloader_parent() -> bool:
+        """是否为 Werkzeug 重载器的监视进程（调试模式启动时，实际处理请求的是它启动的子进程）"""
+        return Config.DEBUG and os.environ.get('WERKZEUG_RUN_MAIN') != 'true'
+    
     def __init__(self):
+        # 单例只初始化一次，避免重复构造时重置设置
+        if self._initialized:
+            return
+        self._initialized = True
         self.device_service = DeviceService()
         self.llm_service = LLMService()
+        self.cache_service = CacheService()
         self.max_steps = 50
         self.action_delay = 0.8  # 减少等待时间（原来是1.0）
-        self._stop_flag = getattr(self, '_stop_flag', False)
         
         # 性能优化选项
         self.skip_ui_hierarchy = False  # 是否跳过 UI 层级（可大幅加速，但可能影响准确性）
         self.parallel_enabled = True    # 是否启用并行获取
-        
-        # 延迟初始化 OCR 服务（首次使用时初始化，避免启动时加载模型）
-        if not hasattr(self, '_ocr_service') or self._ocr_service is None:
-            self._ocr_service = None
-        
-        # 滑动检测相关状态
-        self._last_ocr_texts: Optional[set] = None  # 上一次的OCR文字集合
-        self._last_swipe_direction: Optional[str] = None  # 上一次滑动方向
-        self._same_content_swipe_count: int = 0  # 连续滑动内容不变的次数
-        self._page_boundary_info: Optional[str] = None  # 页面边界信息
+        self.screenshot_scale = 0.75    # 发送给 AI 的截图缩放比例（OCR 始终使用原图，坐标不受影响）
+        self.screenshot_quality = 80    # 发送给 AI 的截图 JPEG 质量
+        self.plan_cache_enabled = False  # 是否复用相同任务之前成功的执行步骤（屏幕一致时跳过 AI 分析，默认关闭）
     
-    def stop(self):
-        """停止当前执行"""
-        self._stop_flag = True
+    def shutdown(self, wait: bool = True):
+        """关闭线程池（进程退出时自动调用），未开始的任务直接取消"""
+        self._pool.shutdown(wait=wait, cancel_futures=True)
+        self._ocr_executor.shutdown(wait=wait, cancel_futures=True)
+        if self._ocr_process_pool is not None:
+            self._ocr_process_pool.shutdown(wait=wait, cancel_futures=True)
     
-    def reset_stop_flag(self):
-        """重置停止标志"""
-        self._stop_flag = False
+    def _create_session(self, task: str) -> AgentSession:
+        """创建并登记任务会话"""
+        session = AgentSession(session_id=uuid.uuid4().hex, task=task)
+        with self._sessions_lock:
+            self._sessions[session.session_id] = session
+        return session
+    
+    def _remove_session(self, session_id: str):
+        """任务结束后注销会话"""
+        with self._sessions_lock:
+            self._sessions.pop(session_id, None)
+    
+    def stop(self, session_id: Optional[str] = None) -> bool:
+        """
+        停止任务执行
+        
+        Args:
+            session_id: 要停止的任务会话ID，为空时停止所有正在执行的任务
+            
+        Returns:
+            是否找到了要停止的任务
+        """
+        with self._sessions_lock:
+            if session_id is None:
+                sessions = list(self._sessions.values())
+            else:
+                session = self._sessions.get(session_id)
+                sessions = [session] if session else []
+        for session in sessions:
+            session.stop_flag = True
+        return bool(sessions)
     
-    def is_stopped(self) -> bool:
-        """检查是否已停止"""
-        return self._stop_flag
+    def is_stopped(self, session: AgentSession) -> bool:
+        """检查任务是否已停止"""
+        return session.stop_flag
     
-    def _reset_swipe_detection(self):
+    def _reset_swipe_detection(self, session: AgentSession):
         """重置滑动检测状态"""
-        self._last_ocr_texts = None
-        self._last_swipe_direction = None
-        self._same_content_swipe_count = 0
-        self._page_boundary_info = None
+        session.last_ocr_texts = None
+        session.last_swipe_direction = None
+        session.same_content_swipe_count = 0
+        session.page_boundary_info = None
     
-    def _extract_ocr_texts(self, ocr_result: Dict[str, Any]) -> set:
-        """从OCR结果中提取文字集合"""
+    def _extract_ocr_texts(self, ocr_result: Dict[str, Any]) -> FrozenSet[str]:
+        """
+        从OCR结果中提取文字集合（不可变，可直接保存到会话中复用）
+        结果缓存在 OCR 结果的 '_texts' 字段中，同一步内边界检测、计划匹配和记录只提取一次
+        """
         if not ocr_result or ocr_result.get('error'):
-            return set()
-        elements = ocr_result.get('elements', [])
-        return set(elem['text'] for elem in elements if elem.get('text'))
+            return frozenset()
+        texts = ocr_result.get('_texts')
+        if texts is None:
+            texts = frozenset({elem['text'] for elem in ocr_result.get('elements', []) if elem.get('text')})
+            ocr_result['_texts'] = texts
+        return texts
     
     def _summarize_ocr_for_comparison(self, ocr_result: Dict[str, Any], max_items: int = 15) -> str:
         """
@@ -94,25 +213,34 @@ class AgentService:
         
         return ", ".join(texts)
     
-    def _calculate_content_similarity(self, texts1: set, texts2: set) -> float:
+    def _calculate_content_similarity(self, texts1: AbstractSet[str], texts2: AbstractSet[str], threshold: float = 0.0) -> float:
         """
         计算两个文字集合的相似度 (Jaccard相似度)
         返回 0-1 之间的值，1表示完全相同
+        
+        Args:
+            threshold: 调用方使用的判定阈值；两个集合大小相差过大、相似度不可能达到阈值时直接返回 0.0
         """
-        if not texts1 and not texts2:
+        len1, len2 = len(texts1), len(texts2)
+        if not len1 and not len2:
             return 1.0
-        if not texts1 or not texts2:
+        if not len1 or not len2:
+            return 0.0
+        
+        # Jaccard 相似度不会超过 min/max（交集最多为较小集合，并集至少为较大集合）
+        if min(len1, len2) / max(len1, len2) < threshold:
             return 0.0
         
+        # |A∪B| = |A| + |B| - |A∩B|，只构建交集，省去并集集合的分配
         intersection = len(texts1 & texts2)
-        union = len(texts1 | texts2)
-        return intersection / union if union > 0 else 0.0
+        return intersection / (len1 + len2 - intersection)
     
-    def _detect_page_boundary(self, current_ocr: Dict[str, Any], last_action: Dict[str, Any]) -> str:
+    def _detect_page_boundary(self, session: AgentSession, current_ocr: Dict[str, Any], last_action: Dict[str, Any]) -> str:
         """
         检测是否到达页面边界
         
         Args:
+            session: 任务会话
             current_ocr: 当前OCR结果
             last_action: 上一次执行的操作
             
@@ -121,7 +249,7 @@ class AgentService:
         """
         # 只对滑动操作进行检测
         if not last_action or last_action.get('type') != 'swipe':
-            self._reset_swipe_detection()
+            self._reset_swipe_detection(session)
             return ""
         
         params = last_action.get('params', {})
@@ -134,174 +262,345 @@ class AgentService:
         current_texts = self._extract_ocr_texts(current_ocr)
         
         # 如果有上一次的OCR记录，计算相似度
-        if self._last_ocr_texts is not None:
-            similarity = self._calculate_content_similarity(self._last_ocr_texts, current_texts)
+        if session.last_ocr_texts is not None:
+            similarity = self._calculate_content_similarity(
+                session.last_ocr_texts, current_texts, self.SWIPE_SIMILARITY_THRESHOLD
+            )
             
             # 如果相似度超过90%，说明内容几乎没变化
-            if similarity > 0.9:
+            if similarity > self.SWIPE_SIMILARITY_THRESHOLD:
                 # 同方向滑动
-                if current_direction == self._last_swipe_direction:
-                    self._same_content_swipe_count += 1
+                if current_direction == session.last_swipe_direction:
+                    session.same_content_swipe_count += 1
                 else:
-                    self._same_content_swipe_count = 1
+                    session.same_content_swipe_count = 1
                 
                 # 连续2次同方向滑动内容不变，判断为到达边界
-                if self._same_content_swipe_count >= 2:
-                    if current_direction == 'up':
-                        self._page_boundary_info = "【注意】页面已经到达底部，继续向上滑动无效。如需查找更多内容，请尝试向下滑动（回到顶部方向）。"
-                    elif current_direction == 'down':
-                        self._page_boundary_info = "【注意】页面已经到达顶部，继续向下滑动无效。如需查找更多内容，请尝试向上滑动（向底部方向）。"
-                    elif current_direction == 'left':
-                        self._page_boundary_info = "【注意】页面已经到达最右侧，继续向左滑动无效。请尝试向右滑动。"
-                    elif current_direction == 'right':
-                        self._page_boundary_info = "【注意】页面已经到达最左侧，继续向右滑动无效。请尝试向左滑动。"
+                if session.same_content_swipe_count >= 2:
+                    session.page_boundary_info = _BOUNDARY_MSGS.get(current_direction, session.page_boundary_info)
             else:
                 # 内容有变化，重置计数
-                self._same_content_swipe_count = 0
-                self._page_boundary_info = None
+                session.same_content_swipe_count = 0
+                session.page_boundary_info = None
         
         # 更新记录
-        self._last_ocr_texts = current_texts
-        self._last_swipe_direction = current_direction
+        session.last_ocr_texts = current_texts
+        session.last_swipe_direction = current_direction
         
-        return self._page_boundary_info or ""
+        return session.page_boundary_info or ""
+    
+    def _plan_key(self, task: str, screen_size) -> str:
+        """执行计划的缓存键：记录的是绝对坐标，按设备和屏幕尺寸区分"""
+        width, height = screen_size
+        return f"{self.device_service.get_serial()}|{width}x{height}|{task.strip()}"
+    
+    def _load_plan(self, task: str, screen_size) -> Optional[List[Dict[str, Any]]]:
+        """读取相同任务在同一设备上之前成功执行的步骤"""
+        if not self.plan_cache_enabled:
+            return None
+        return self.cache_service.get(self.PLAN_CACHE_NAMESPACE, self._plan_key(task, screen_size))
+    
+    def _save_plan(self, task: str, screen_size, plan_steps: List[Dict[str, Any]]):
+        """记录成功完成的任务的执行步骤"""
+        if self.plan_cache_enabled and plan_steps:
+            self.cache_service.set(self.PLAN_CACHE_NAMESPACE, self._plan_key(task, screen_size), plan_steps)
+    
+    def clear_plan_cache(self):
+        """清空记录的执行计划"""
+        self.cache_service.clear(self.PLAN_CACHE_NAMESPACE)
+    
+    @staticmethod
+    def _click_points(action) -> List[tuple]:
+        """操作（或链式操作）中所有点击的坐标"""
+        actions = action if isinstance(action, list) else [action]
+        return [
+            (a.get('params', {}).get('x'), a.get('params', {}).get('y'))
+            for a in actions if isinstance(a, dict) and a.get('type') == 'click'
+        ]
+    
+    @staticmethod
+    def _ocr_text_at(ocr_result: Dict[str, Any], x, y) -> Optional[str]:
+        """返回包含坐标 (x, y) 的 OCR 文字，没有时返回 None"""
+        if not ocr_result or ocr_result.get('error') or x is None or y is None:
+            return None
+        for elem in ocr_result.get('elements', []):
+            bounds = elem['bounds']
+            if bounds['left'] <= x <= bounds['right'] and bounds['top'] <= y <= bounds['bottom']:
+                return elem['text']
+        return None
+    
+    def _match_plan_step(self, plan_step: Dict[str, Any], current_app: Dict[str, str],
+                         current_ocr: Dict[str, Any]) -> bool:
+        """
+        判断当前屏幕是否与记录该步骤时一致：同一APP、屏幕文字高度相似，
+        且每个点击位置上仍是记录时的文字（页面滚动、布局变化时不复用）
+        """
+        package = current_app.get('package', '') if current_app else ''
+        if package != plan_step.get('package'):
+            return False
+        similarity = self._calculate_content_similarity(
+            set(plan_step.get('texts', [])), self._extract_ocr_texts(current_ocr), self.PLAN_MATCH_THRESHOLD
+        )
+        if similarity < self.PLAN_MATCH_THRESHOLD:
+            return False
+        
+        # 点击位置没有文字的步骤（如图标）无法确认目标，交给 AI
+        points = self._click_points(plan_step['action'])
+        targets = plan_step.get('targets', [])
+        if len(targets) != len(points):
+            return False
+        return all(
+            target is not None and self._ocr_text_at(current_ocr, x, y) == target
+            for (x, y), target in zip(points, targets)
+        )
     
     def _get_ocr_service(self) -> ocr_service:
-        """获取 OCR 服务（延迟初始化）"""
+        """获取 OCR 服务（优先使用后台预加载的实例，预加载失败时再初始化）"""
         if self._ocr_service is None:
-            self._ocr_service = ocr_service()
+            try:
+                if self._ocr_ready is None:
+                    raise RuntimeError('未预加载')
+                self._ocr_service = self._ocr_ready.result()
+            except Exception as e:
+                print(f"OCR 模型预加载失败: {e}，重新初始化")
+                self._ocr_service = ocr_service()
         return self._ocr_service
     
-    def _get_screen_state(self, skip_ui_hierarchy: bool = False) -> tuple:
+    def _recognize(self, image) -> Dict[str, Any]:
+        """识别截图文字（开启 OCR_USE_PROCESS 时在子进程中执行）"""
+        if self._ocr_process_pool is not None:
+            gray = ocr_service._load_gray_image(image)
+            return self._ocr_process_pool.submit(ocr_process_get_all_text_with_positions, gray).result()
+        return self._get_ocr_service().get_all_text_with_positions(image)
+    
+    def _get_cached_ocr(self, screen_hash: str) -> Optional[Dict[str, Any]]:
+        """按截图内容哈希查找 OCR 缓存"""
+        with self._ocr_cache_lock:
+            ocr_result = self._ocr_cache.get(screen_hash)
+            if ocr_result is not None:
+                self._ocr_cache.move_to_end(screen_hash)
+            return ocr_result
+    
+    def _cache_ocr(self, screen_hash: str, ocr_result: Dict[str, Any]):
+        """缓存 OCR 结果（识别失败的不缓存）"""
+        if not ocr_result or ocr_result.get('error'):
+            return
+        with self._ocr_cache_lock:
+            self._ocr_cache[screen_hash] = ocr_result
+            self._ocr_cache.move_to_end(screen_hash)
+            while len(self._ocr_cache) > self.OCR_CACHE_SIZE:
+                self._ocr_cache.popitem(last=False)
+    
+    def _encode_screenshot_for_llm(self, screenshot: Dict[str, Any]) -> str:
+        """按 screenshot_scale / screenshot_quality 压缩截图，返回发送给 AI 的 data URI"""
+        jpeg = self.device_service.encode_jpeg(screenshot['image'], self.screenshot_scale, self.screenshot_quality)
+        return self.device_service.to_data_uri(jpeg, 'image/jpeg')
+    
+    def _wait_ui_stable(self, deadline: float, before_hierarchy: Optional[str] = None,
+                        poll_interval: float = 0.1, min_wait: float = 0.25) -> Optional[str]:
+        """
+        等待界面稳定：轮询 UI 层级，连续两次完全一致且与操作前不同即认为稳定，最多等到 deadline
+        点击后旧页面常会保持 100-300ms 不变（水波纹不影响层级），因此先等待 min_wait 再开始轮询，
+        且与操作前相同的层级不视为稳定（界面确实没有变化时等满 deadline）
+        
+        Args:
+            deadline: 最晚等待到的时间点（time.monotonic()）
+            before_hierarchy: 操作前的 UI 层级
+            poll_interval: 轮询间隔（秒）
+            min_wait: 开始轮询前的最短等待时间（秒）
+            
+        Returns:
+            稳定后的 UI 层级 XML；到达 deadline 仍未稳定时返回 None（由调用方重新获取）
+        """
+        time.sleep(max(0.0, min(min_wait, deadline - time.monotonic())))
+        
+        previous = None
+        while time.monotonic() < deadline:
+            try:
+                # 轮询比较前后两次层级，必须绕过缓存
+                hierarchy = self.device_service.dump_hierarchy(max_age=0)
+            except Exception as e:
+                print(f"等待界面稳定时获取UI层级失败: {e}")
+                break
+            if hierarchy and hierarchy == previous and hierarchy != before_hierarchy:
+                return hierarchy
+            # 获取层级本身可能较慢，获取后再检查一次是否已超时
+            if time.monotonic() >= deadline:
+                break
+            previous = hierarchy
+            time.sleep(max(0.0, min(poll_interval, deadline - time.monotonic())))
+        
+        remaining = deadline - time.monotonic()
+        if remaining > 0:
+            time.sleep(remaining)
+        return None
+    
+    def _get_screen_state(self, skip_ui_hierarchy: bool = False, ui_hierarchy: Optional[str] = None) -> tuple:
         """
         获取当前屏幕状态，包含 OCR 识别结果和耗时统计
         使用并行执行优化性能
         
         Args:
             skip_ui_hierarchy: 是否跳过 UI 层级获取（可加速约 500-1500ms）
+            ui_hierarchy: 已获取到的 UI 层级（如等待界面稳定时得到的），传入后不再重复获取
         
         Returns:
             (screenshot, ui_hierarchy, current_app, ocr_result, timing)
+            screenshot 为 {'id', 'data', 'mimetype', 'image', 'size'}，data 为缩小的 JPEG 预览，
+            id 可通过 /api/device/screenshot/<id> 获取，image 为原始分辨率的 PIL 图像，size 为设备分辨率
         """
         timing = {}
-        total_start = time.time()
-        
-        # 使用线程池并行执行
-        with concurrent.futures.ThreadPoolExecutor(max_workers=3) as executor:
-            # 提交并行任务
-            # 任务1: 截图 + 保存 + OCR（串行，因为 OCR 依赖截图）
-            def screenshot_and_ocr():
-                result = {'screenshot': None, 'ocr': None, 'timing': {}}
-                
-                # 截图
-                t0 = time.time()
-                result['screenshot'] = self.device_service.get_screenshot()
-                result['timing']['screenshot'] = round((time.time() - t0) * 1000)
-                
-                # 保存截图供 OCR 使用
-                t0 = time.time()
-                screenshot_file = self.device_service.get_screenshot_file()
-                result['timing']['save_screenshot'] = round((time.time() - t0) * 1000)
-                
-                # OCR 识别
-                t0 = time.time()
-                try:
-                    ocr_svc = self._get_ocr_service()
-                    result['ocr'] = ocr_svc.get_all_text_with_positions(screenshot_file)
-                except Exception as e:
-                    print(f"OCR识别失败: {e}")
-                    result['ocr'] = {"error": str(e), "elements": []}
-                result['timing']['ocr'] = round((time.time() - t0) * 1000)
-                
-                return result
-            
-            # 任务2: UI 层级（可选）
-            def get_ui_hierarchy():
-                if skip_ui_hierarchy:
-                    return {'hierarchy': '', 'time': 0}
-                t0 = time.time()
-                hierarchy = self.device_service.dump_hierarchy()
-                return {'hierarchy': hierarchy, 'time': round((time.time() - t0) * 1000)}
+        total_start = time.monotonic()
+        
+        # 任务1: 截图（只截一次：原图供 OCR，缩小的 JPEG 预览缓存到设备服务，SSE 只推送截图ID）
+        def capture_screenshot():
+            t0 = time.monotonic()
+            image = self.device_service.get_screenshot_image()
+            preview = self.device_service.encode_preview(image)
+            screenshot = {
+                'id': self.device_service.cache_screenshot(preview, 'image/jpeg'),
+                'data': preview,
+                'mimetype': 'image/jpeg',
+                'image': image,
+                'size': image.size
+            }
+            return {'screenshot': screenshot, 'time': int((time.monotonic() - t0) * 1000)}
+        
+        # 任务2: OCR（依赖截图，截图完成后再提交）
+        def screenshot_ocr(screenshot):
+            result = {'ocr': None, 'timing': {}}
             
-            # 任务3: 当前应用信息
-            def get_current_app():
-                t0 = time.time()
-                app = self.device_service.get_current_app()
-                return {'app': app, 'time': round((time.time() - t0) * 1000)}
+            # 画面与之前某一步完全相同（截图ID即内容哈希），直接复用 OCR 结果
+            cached_ocr = self._get_cached_ocr(screenshot['id'])
+            if cached_ocr is not None:
+                result['ocr'] = cached_ocr
+                result['timing']['ocr'] = 0
+                result['timing']['ocr_cached'] = 1
+                return result
             
-            # 并行提交任务
-            future_screenshot_ocr = executor.submit(screenshot_and_ocr)
-            future_ui = executor.submit(get_ui_hierarchy)
-            future_app = executor.submit(get_current_app)
+            # OCR 识别（使用同一帧的原始分辨率图像，不再重复截图落盘）
+            t0 = time.monotonic()
+            try:
+                result['ocr'] = self._recognize(screenshot['image'])
+                self._cache_ocr(screenshot['id'], result['ocr'])
+            except Exception as e:
+                print(f"OCR识别失败: {e}")
+                result['ocr'] = {"error": str(e), "elements": []}
+            result['timing']['ocr'] = int((time.monotonic() - t0) * 1000)
             
-            # 等待所有任务完成并收集结果
-            screenshot_ocr_result = future_screenshot_ocr.result()
-            ui_result = future_ui.result()
-            app_result = future_app.result()
+            return result
+        
+        # 任务3: UI 层级（可选）
+        def get_ui_hierarchy():
+            if skip_ui_hierarchy:
+                return {'hierarchy': '', 'time': 0}
+            if ui_hierarchy:
+                return {'hierarchy': ui_hierarchy, 'time': 0}
+            t0 = time.monotonic()
+            hierarchy = self.device_service.dump_hierarchy()
+            return {'hierarchy': hierarchy, 'time': int((time.monotonic() - t0) * 1000)}
+        
+        # 任务4: 当前应用信息
+        def get_current_app():
+            t0 = time.monotonic()
+            app = self.device_service.get_current_app()
+            return {'app': app, 'time': int((time.monotonic() - t0) * 1000)}
+        
+        # 并行提交任务（复用常驻线程池，避免每步创建/销毁线程）
+        # 截图走 uiautomator2 的 JSON-RPC 转发通道，UI 层级/应用信息走 adb shell，
+        # 二者本身就是独立的 adb 流，无需额外建立截图专用连接即可在链路上重叠
+        future_screenshot = self._pool.submit(capture_screenshot)
+        future_ui = self._pool.submit(get_ui_hierarchy)
+        future_app = self._pool.submit(get_current_app)
+        
+        # 截图一完成就提交给 OCR worker，与 UI 层级、应用信息的获取重叠执行
+        screenshot_result = future_screenshot.result()
+        future_ocr = self._ocr_executor.submit(screenshot_ocr, screenshot_result['screenshot'])
+        
+        # 等待所有任务完成并收集结果
+        concurrent.futures.wait([future_ocr, future_ui, future_app])
+        ocr_task_result = future_ocr.result()
+        ui_result = future_ui.result()
+        app_result = future_app.result()
         
         # 汇总结果
-        screenshot = screenshot_ocr_result['screenshot']
-        ocr_result = screenshot_ocr_result['ocr']
+        screenshot = screenshot_result['screenshot']
+        ocr_result = ocr_task_result['ocr']
         ui_hierarchy = ui_result['hierarchy']
         current_app = app_result['app']
         
         # 汇总耗时
-        timing.update(screenshot_ocr_result['timing'])
+        timing['screenshot'] = screenshot_result['time']
+        timing.update(ocr_task_result['timing'])
         timing['ui_hierarchy'] = ui_result['time']
         timing['current_app'] = app_result['time']
         
         # 计算总耗时（并行执行后的实际耗时）
-        timing['total'] = round((time.time() - total_start) * 1000)
+        timing['total'] = int((time.monotonic() - total_start) * 1000)
         
-        # 计算节省的时间（串行耗时 - 并行耗时）
-        serial_time = sum(v for k, v in timing.items() if k != 'total')
-        timing['saved'] = serial_time - timing['total']
+        # 串行耗时（各步骤相加）与节省的时间（串行耗时 - 并行耗时），只计算一次供格式化复用
+        timing['serial'] = timing['screenshot'] + timing['ocr'] + timing['ui_hierarchy'] + timing['current_app']
+        timing['saved'] = timing['serial'] - timing['total']
         
         return screenshot, ui_hierarchy, current_app, ocr_result, timing
     
     def _format_timing(self, timing: Dict[str, int], verbose: bool = True) -> str:
-        """格式化耗时统计信息"""
-        parts = []
-        
-        # 显示所有主要耗时项
-        if 'screenshot' in timing:
-            parts.append(f"截图:{timing['screenshot']}ms")
-        if 'save_screenshot' in timing and timing['save_screenshot'] > 0:
-            parts.append(f"保存:{timing['save_screenshot']}ms")
-        if 'ui_hierarchy' in timing and timing['ui_hierarchy'] > 0:
-            parts.append(f"布局:{timing['ui_hierarchy']}ms")
-        if 'ocr' in timing:
-            parts.append(f"OCR:{timing['ocr']}ms")
-        if 'current_app' in timing and timing['current_app'] > 0:
-            parts.append(f"应用:{timing['current_app']}ms")
-        
-        # 串行总耗时（各步骤相加）
-        serial_time = sum(v for k, v in timing.items() if k not in ['total', 'saved'])
-        
-        # 并行实际耗时
-        total = timing.get('total', 0)
-        
-        # 显示对比
-        parts.append(f"串行:{serial_time}ms")
-        parts.append(f"并行:{total}ms")
-        
-        # 显示节省的时间
+        """格式化耗时统计信息（截图 | 布局 | OCR | 应用 | 串行 | 并行 | 省）"""
+        ui_time = timing.get('ui_hierarchy', 0)
+        app_time = timing.get('current_app', 0)
         saved = timing.get('saved', 0)
-        if saved > 0:
-            parts.append(f"省:{saved}ms")
-        
-        return " | ".join(parts)
+        ocr_time = "复用" if timing.get('ocr_cached') else f"{timing.get('ocr', 0)}ms"
+        
+        return (
+            f"截图:{timing.get('screenshot', 0)}ms"
+            f"{f' | 布局:{ui_time}ms' if ui_time > 0 else ''}"
+            f" | OCR:{ocr_time}"
+            f"{f' | 应用:{app_time}ms' if app_time > 0 else ''}"
+            f" | 串行:{timing.get('serial', 0)}ms | 并行:{timing.get('total', 0)}ms"
+            f"{f' | 省:{saved}ms' if saved > 0 else ''}"
+        )
     
     def execute_task(self, task: str) -> Generator[Dict[str, Any], None, None]:
-        """执行任务"""
-        self.reset_stop_flag()
-        self._reset_swipe_detection()  # 重置滑动检测状态
+        """
+        执行任务
+        首个事件为 {'type': 'session', 'session_id'}，前端据此停止对应的任务
+        """
+        session = self._create_session(task)
+        try:
+            yield {'type': 'session', 'session_id': session.session_id}
+            yield from self._batch_events(self._run_task(session))
+        finally:
+            self._remove_session(session.session_id)
+    
+    @staticmethod
+    def _batch_events(events: Generator[Dict[str, Any], None, None]) -> Generator[Dict[str, Any], None, None]:
+        """
+        合并非关键事件，减少推送帧数
+        info/done/warning（不带截图的）先暂存，遇到下一个关键事件时一起以 {'type': 'step', 'events': [...]} 推送
+        """
+        pending = []
+        for event in events:
+            if event['type'] in _DEFERRABLE_EVENT_TYPES and 'screenshot_id' not in event:
+                pending.append(event)
+                continue
+            if pending:
+                pending.append(event)
+                yield {'type': 'step', 'events': pending}
+                pending = []
+            else:
+                yield event
+        if pending:
+            yield {'type': 'step', 'events': pending}
+    
+    def _run_task(self, session: AgentSession) -> Generator[Dict[str, Any], None, None]:
+        """在任务会话中循环执行任务"""
+        task = session.task
         
         if not self.device_service.is_connected():
             yield {'type': 'error', 'message': '设备未连接，请先连接设备'}
             return
         
-        task_start_time = time.time()  # 任务开始时间
+        task_start_time = time.monotonic()  # 任务开始时间
         yield {'type': 'start', 'message': f'🚀 开始执行: {task}'}
         
         # 获取初始屏幕状态
@@ -314,11 +613,12 @@ class AgentService:
             yield {
                 'type': 'info',
                 'message': f'📱 当前应用: {current_app.get("package", "未知")} | OCR: {ocr_count}个 | ⏱️ {timing_str}',
-                'screenshot': current_screenshot,
+                'screenshot_id': current_screenshot['id'],
+                'screen_size': current_screenshot['size'],
                 'timing': init_timing
             }
             # 初始化OCR文字记录
-            self._last_ocr_texts = self._extract_ocr_texts(current_ocr)
+            session.last_ocr_texts = self._extract_ocr_texts(current_ocr)
         except Exception as e:
             yield {'type': 'error', 'message': f'获取屏幕状态失败: {str(e)}'}
             return
@@ -327,12 +627,18 @@ class AgentService:
         previous_action_result = None
         last_action = None  # 记录上一次执行的操作
         previous_app_package = None  # 记录上一步的APP包名，用于检测APP切换
-        action_history = []  # 操作历史记录
-        memories = []  # AI 记录的关键信息（如短信内容、查询结果等）
+        # 只保留最近的记录，提示词长度不随步数增长（AI 只参考最近几步操作）
+        action_history = deque(maxlen=self.ACTION_HISTORY_SIZE)  # 操作历史记录
+        memories = deque(maxlen=self.MEMORY_SIZE)  # AI 记录的关键信息（如短信内容、查询结果等）
+        
+        # 执行计划：相同任务之前成功的步骤，屏幕一致时直接复用；一旦不一致，后续全部交给 AI
+        plan = self._load_plan(task, current_screenshot['size'])
+        plan_steps = []  # 本次执行的步骤记录（任务完成后保存）
+        plan_recordable = True  # 有操作失败或依赖记忆的任务不保存
         
         while step < self.max_steps:
-            if self.is_stopped():
-                task_duration = round(time.time() - task_start_time, 1)
+            if self.is_stopped(session):
+                task_duration = round(time.monotonic() - task_start_time, 1)
                 yield {'type': 'stopped', 'message': f'⏹️ 任务已停止 | 总耗时: {task_duration}秒 | 执行了{step}步'}
                 return
             
@@ -341,24 +647,40 @@ class AgentService:
             # AI分析
             yield {'type': 'thinking', 'message': f'🤔 步骤{step} 正在分析...'}
             
-            ai_start = time.time()
-            try:
-                result = self.llm_service.analyze_and_act(
-                    task=task,
-                    screenshot=current_screenshot,
-                    ui_hierarchy=current_ui_hierarchy,
-                    current_app=current_app,
-                    previous_action=previous_action_result,
-                    ocr_result=current_ocr,
-                    previous_app_package=previous_app_package,  # 传递上一步的APP包名
-                    step_number=step,
-                    action_history=action_history,  # 传递操作历史
-                    memories=memories  # 传递记忆信息
-                )
-                ai_time = round((time.time() - ai_start) * 1000)  # AI耗时(毫秒)
-            except Exception as e:
-                yield {'type': 'error', 'message': f'❌ AI分析失败: {str(e)}'}
-                return
+            ai_start = time.monotonic()
+            plan_step = plan[step - 1] if plan and step <= len(plan) else None
+            replayed = plan_step is not None and self._match_plan_step(plan_step, current_app, current_ocr)
+            if replayed:
+                result = {
+                    'status': 'action',
+                    'action': plan_step['action'],
+                    'message': plan_step['message'],
+                    'debug': {'replayed': True}
+                }
+                ai_time = 0
+            else:
+                plan = None  # 屏幕与记录不一致，后续步骤不再复用
+                try:
+                    # 纯文本模型用不到截图，不做压缩编码
+                    llm_screenshot = None
+                    if self.llm_service.model_supports_vision():
+                        llm_screenshot = self._encode_screenshot_for_llm(current_screenshot)
+                    result = self.llm_service.analyze_and_act(
+                        task=task,
+                        screenshot=llm_screenshot,
+                        ui_hierarchy=current_ui_hierarchy,
+                        current_app=current_app,
+                        previous_action=previous_action_result,
+                        ocr_result=current_ocr,
+                        previous_app_package=previous_app_package,  # 传递上一步的APP包名
+                        step_number=step,
+                        action_history=list(action_history),  # 传递操作历史
+                        memories=list(memories)  # 传递记忆信息
+                    )
+                    ai_time = int((time.monotonic() - ai_start) * 1000)  # AI耗时(毫秒)
+                except Exception as e:
+                    yield {'type': 'error', 'message': f'❌ AI分析失败: {str(e)}'}
+                    return
             
             # 更新上一步的APP包名
             previous_app_package = current_app.get('package', '') if current_app else None
@@ -371,25 +693,28 @@ class AgentService:
             
             # 如果 AI 记录了新的记忆，保存下来
             if memory:
+                plan_recordable = False  # 需要读取实时信息的任务不能复用
                 memories.append(memory)
                 yield {'type': 'info', 'message': f'📝 记录: {memory}'}
             
             # 添加 AI 耗时到 debug 信息
             debug['ai_time_ms'] = ai_time
-            debug['memories'] = memories.copy()  # 添加当前记忆到 debug
+            debug['memories'] = list(memories)  # 添加当前记忆到 debug
             
             if status == 'completed':
-                task_duration = round(time.time() - task_start_time, 1)
+                task_duration = round(time.monotonic() - task_start_time, 1)
                 # 如果有记忆，在完成消息中包含
                 complete_msg = f'✅ {message}'
                 if memories:
                     complete_msg += f'\n📋 记录的信息: {"; ".join(memories)}'
                 complete_msg += f'\n⏱️ 总耗时: {task_duration}秒 | 共{step}步 | 本步AI:{ai_time}ms'
+                if plan_recordable:
+                    self._save_plan(task, current_screenshot['size'], plan_steps)
                 yield {'type': 'completed', 'message': complete_msg, 'debug': debug}
                 return
             
             elif status == 'failed':
-                task_duration = round(time.time() - task_start_time, 1)
+                task_duration = round(time.monotonic() - task_start_time, 1)
                 yield {'type': 'failed', 'message': f'❌ {message}\n⏱️ 总耗时: {task_duration}秒 | 共{step}步', 'debug': debug}
                 return
             
@@ -399,26 +724,35 @@ class AgentService:
                 chain_info = f" [链式x{len(action)}]" if is_chain else ""
                 yield {
                     'type': 'action',
-                    'message': f'▶️ 步骤{step}: {message}{chain_info} (AI:{ai_time}ms)',
+                    'message': f'▶️ 步骤{step}: {message}{chain_info} ({"复用历史步骤" if replayed else f"AI:{ai_time}ms"})',
                     'action': action,
                     'debug': debug
                 }
                 
-                if self.is_stopped():
-                    task_duration = round(time.time() - task_start_time, 1)
+                if self.is_stopped(session):
+                    task_duration = round(time.monotonic() - task_start_time, 1)
                     yield {'type': 'stopped', 'message': f'⏹️ 任务已停止 | 总耗时: {task_duration}秒 | 执行了{step}步'}
                     return
                 
                 # 执行操作
-                action_start = time.time()
+                action_start = time.monotonic()
                 # 记录执行前的状态（供 AI 对比判断）
                 pre_ocr_summary = self._summarize_ocr_for_comparison(current_ocr)
                 pre_package = current_app.get('package', '') if current_app else ''
                 
                 try:
                     action_result = self._execute_action(action)
-                    action_time = round((time.time() - action_start) * 1000)
+                    settle_deadline = time.monotonic() + self.action_delay  # 界面稳定等待从操作完成时开始计时
+                    action_time = int((time.monotonic() - action_start) * 1000)
                     last_action = action  # 记录执行的操作
+                    plan_steps.append({
+                        'package': pre_package,
+                        'texts': sorted(self._extract_ocr_texts(current_ocr)),
+                        # 每个点击位置上的文字，复用时确认目标没有移动
+                        'targets': [self._ocr_text_at(current_ocr, x, y) for x, y in self._click_points(action)],
+                        'action': action,
+                        'message': message
+                    })
                     # 记录到操作历史
                     action_history.append(f"{message} ({action_result})")
                     yield {'type': 'done', 'message': f'✓ {action_result} ({action_time}ms)'}
@@ -426,20 +760,30 @@ class AgentService:
                     # 记录上一步操作结果
                     previous_action_result = f"执行: {action_result}"
                 except Exception as e:
-                    action_time = round((time.time() - action_start) * 1000)
+                    settle_deadline = time.monotonic() + self.action_delay
+                    action_time = int((time.monotonic() - action_start) * 1000)
                     previous_action_result = f"执行失败: {str(e)}"
                     last_action = None
+                    plan_recordable = False
                     pre_ocr_summary = None  # 执行失败时不需要对比
                     pre_package = None
                     action_history.append(f"{message} (失败: {str(e)})")
                     yield {'type': 'warning', 'message': f'⚠️ {str(e)} ({action_time}ms)'}
                 
-                # 等待并获取新状态
-                time.sleep(self.action_delay)
+                # 等待界面稳定后获取新状态（推送消息、记录历史的耗时已计入等待时间）
+                # 需要 UI 层级时轮询层级，界面提前稳定即可继续，action_delay 为最长等待时间
+                stable_hierarchy = None
+                if self.skip_ui_hierarchy:
+                    remaining_delay = settle_deadline - time.monotonic()
+                    if remaining_delay > 0:
+                        time.sleep(remaining_delay)
+                else:
+                    stable_hierarchy = self._wait_ui_stable(settle_deadline, current_ui_hierarchy)
                 
                 try:
                     current_screenshot, current_ui_hierarchy, current_app, current_ocr, step_timing = self._get_screen_state(
-                        skip_ui_hierarchy=self.skip_ui_hierarchy
+                        skip_ui_hierarchy=self.skip_ui_hierarchy,
+                        ui_hierarchy=stable_hierarchy
                     )
                     ocr_count = len(current_ocr.get('elements', [])) if current_ocr else 0
                     
@@ -450,7 +794,7 @@ class AgentService:
                         previous_action_result += f"\n【操作前屏幕文字】: {pre_ocr_summary}"
                     
                     # 检测页面边界（滑动后内容是否变化）- 保留原有逻辑
-                    boundary_info = self._detect_page_boundary(current_ocr, last_action)
+                    boundary_info = self._detect_page_boundary(session, current_ocr, last_action)
                     if boundary_info:
                         previous_action_result += f"\n{boundary_info}"
                     
@@ -459,65 +803,75 @@ class AgentService:
                     yield {
                         'type': 'update',
                         'message': f'📱 当前: {current_app.get("package", "").split(".")[-1] or "未知"} | OCR: {ocr_count}个 | ⏱️ {timing_str}',
-                        'screenshot': current_screenshot,
+                        'screenshot_id': current_screenshot['id'],
+                        'screen_size': current_screenshot['size'],
                         'timing': step_timing
                     }
                 except Exception as e:
                     yield {'type': 'warning', 'message': f'⚠️ 获取屏幕失败，继续'}
             else:
-                task_duration = round(time.time() - task_start_time, 1)
+                task_duration = round(time.monotonic() - task_start_time, 1)
                 yield {'type': 'error', 'message': f'❌ 无效响应 | 总耗时: {task_duration}秒 | 执行了{step}步'}
                 return
         
-        task_duration = round(time.time() - task_start_time, 1)
+        task_duration = round(time.monotonic() - task_start_time, 1)
         yield {'type': 'warning', 'message': f'⏱️ 已达最大步数({self.max_steps}步) | 总耗时: {task_duration}秒'}
     
+    def _act_click(self, params: Dict[str, Any]) -> str:
+        x, y = params.get('x'), params.get('y')
+        self.device_service.click(x, y)
+        return f'点击({x},{y})'
+    
+    def _act_swipe(self, params: Dict[str, Any]) -> str:
+        if 'direction' in params:
+            self.device_service.swipe_ext(params['direction'])
+            return f'向{params["direction"]}滑动'
+        self.device_service.swipe(
+            params.get('start_x'), params.get('start_y'),
+            params.get('end_x'), params.get('end_y'),
+            params.get('duration', 0.5)
+        )
+        return '滑动'
+    
+    def _act_input(self, params: Dict[str, Any]) -> str:
+        text = params.get('text', '')
+        self.device_service.send_keys(text)
+        return f'输入"{text}"'
+    
+    def _act_press(self, params: Dict[str, Any]) -> str:
+        key = params.get('key', 'back')
+        self.device_service.press(key)
+        return f'按{key}'
+    
+    def _act_wait(self, params: Dict[str, Any]) -> str:
+        seconds = params.get('seconds', 1)
+        time.sleep(seconds)
+        return f'等待{seconds}秒'
+    
+    def _act_start_app(self, params: Dict[str, Any]) -> str:
+        package = params.get('package')
+        if not package:
+            raise Exception('缺少包名')
+        self.device_service.app_start(package)
+        return f'启动{package}'
+    
+    # 操作类型 -> 处理方法
+    _HANDLERS = {
+        'click': _act_click,
+        'swipe': _act_swipe,
+        'input': _act_input,
+        'press': _act_press,
+        'wait': _act_wait,
+        'start_app': _act_start_app,
+    }
+    
     def _execute_single_action(self, action: Dict[str, Any]) -> str:
         """执行单个操作（内部方法）"""
         action_type = action.get('type')
-        params = action.get('params', {})
-        
-        if action_type == 'click':
-            x, y = params.get('x'), params.get('y')
-            self.device_service.click(x, y)
-            return f'点击({x},{y})'
-        
-        elif action_type == 'swipe':
-            if 'direction' in params:
-                self.device_service.swipe_ext(params['direction'])
-                return f'向{params["direction"]}滑动'
-            else:
-                self.device_service.swipe(
-                    params.get('start_x'), params.get('start_y'),
-                    params.get('end_x'), params.get('end_y'),
-                    params.get('duration', 0.5)
-                )
-                return '滑动'
-        
-        elif action_type == 'input':
-            text = params.get('text', '')
-            self.device_service.send_keys(text)
-            return f'输入"{text}"'
-        
-        elif action_type == 'press':
-            key = params.get('key', 'back')
-            self.device_service.press(key)
-            return f'按{key}'
-        
-        elif action_type == 'wait':
-            seconds = params.get('seconds', 1)
-            time.sleep(seconds)
-            return f'等待{seconds}秒'
-        
-        elif action_type == 'start_app':
-            package = params.get('package')
-            if not package:
-                raise Exception('缺少包名')
-            self.device_service.app_start(package)
-            return f'启动{package}'
-        
-        else:
+        handler = self._HANDLERS.get(action_type)
+        if handler is None:
             raise Exception(f'未知操作: {action_type}')
+        return handler(self, action.get('params', {}))
     
     def _execute_action(self, action) -> str:
         """
@@ -0,0 +1,113 @@
+import os
+import time
+import sqlite3
+import threading
+from typing import Any, Optional
+
+import orjson
+
+
+class CacheService:
+    """
+    持久化缓存服务 - 基于 SQLite
+    按命名空间存储 JSON 可序列化的数据，进程重启后依然有效
+    """
+
+    _instance = None
+
+    # 默认数据库文件（可通过环境变量 CACHE_DB_PATH 修改）
+    DEFAULT_DB_PATH = 'aidut_cache.db'
+
+    def __new__(cls):
+        """单例模式，进程内共享一个数据库连接"""
+        if cls._instance is None:
+            cls._instance = super().__new__(cls)
+            cls._instance._lock = threading.Lock()
+            cls._instance._conn = cls._instance._connect(
+                os.getenv('CACHE_DB_PATH') or cls.DEFAULT_DB_PATH
+            )
+        return cls._instance
+
+    @staticmethod
+    def _connect(db_path: str) -> Optional[sqlite3.Connection]:
+        """打开数据库并建表，失败时返回 None（缓存不可用但不影响主流程）"""
+        try:
+            conn = sqlite3.connect(db_path, check_same_thread=False, isolation_level=None)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            conn.execute(
+                'CREATE TABLE IF NOT EXISTS cache ('
+                'namespace TEXT NOT NULL, key TEXT NOT NULL, value BLOB NOT NULL, created REAL NOT NULL, '
+                'PRIMARY KEY (namespace, key))'
+            )
+            return conn
+        except sqlite3.Error as e:
+            print(f"打开缓存数据库失败: {e}")
+            return None
+
+    def get(self, namespace: str, key: str, max_age: Optional[float] = None) -> Optional[Any]:
+        """
+        读取缓存
+
+        Args:
+            max_age: 最长有效期（秒），超过时删除该条并视为不存在；None 表示永久有效
+
+        Returns:
+            缓存的数据，不存在时返回 None
+        """
+        if self._conn is None:
+            return None
+        try:
+            with self._lock:
+                row = self._conn.execute(
+                    'SELECT value, created FROM cache WHERE namespace = ? AND key = ?', (namespace, key)
+                ).fetchone()
+                if row and max_age is not None and time.time() - row[1] > max_age:
+                    self._conn.execute('DELETE FROM cache WHERE namespace = ? AND key = ?', (namespace, key))
+                    row = None
+            return orjson.loads(row[0]) if row else None
+        except (sqlite3.Error, orjson.JSONDecodeError) as e:
+            print(f"读取缓存失败: {e}")
+            return None
+
+    def set(self, namespace: str, key: str, value: Any,
+            max_age: Optional[float] = None, max_entries: Optional[int] = None):
+        """
+        写入缓存（已存在则覆盖）
+
+        Args:
+            max_age: 写入时顺便删除该命名空间中超过有效期（秒）的条目
+            max_entries: 该命名空间最多保留的条数，超出时删除最早写入的条目
+        """
+        if self._conn is None:
+            return
+        try:
+            data = orjson.dumps(value, option=orjson.OPT_SERIALIZE_NUMPY)
+            now = time.time()
+            with self._lock:
+                self._conn.execute(
+                    'INSERT OR REPLACE INTO cache (namespace, key, value, created) VALUES (?, ?, ?, ?)',
+                    (namespace, key, data, now)
+                )
+                if max_age is not None:
+                    self._conn.execute(
+                        'DELETE FROM cache WHERE namespace = ? AND created < ?', (namespace, now - max_age)
+                    )
+                if max_entries is not None:
+                    self._conn.execute(
+                        'DELETE FROM cache WHERE namespace = ? AND key NOT IN '
+                        '(SELECT key FROM cache WHERE namespace = ? ORDER BY created DESC LIMIT ?)',
+                        (namespace, namespace, max_entries)
+                    )
+        except (sqlite3.Error, TypeError) as e:
+            print(f"写入缓存失败: {e}")
+
+    def clear(self, namespace: str):
+        """清空指定命名空间的缓存"""
+        if self._conn is None:
+            return
+        try:
+            with self._lock:
+                self._conn.execute('DELETE FROM cache WHERE namespace = ?', (namespace,))
+        except sqlite3.Error as e:
+            print(f"清空缓存失败: {e}")
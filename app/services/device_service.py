@@ -1,11 +1,46 @@
 import uiautomator2 as u2
-import base64
 import os
-import tempfile
+import re
+import base64
+import hashlib
+import time
+import functools
 import subprocess
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from collections import OrderedDict
 from io import BytesIO
-from typing import Optional, Dict, Any, Union, List
-import xml.etree.ElementTree as ET
+from typing import Optional, Dict, Any, Union, List, Tuple
+import numpy as np
+from PIL import Image
+from app.services import adb_host
+from config import env_bool
+
+try:
+    # lxml 的 C 解析器更快，未安装时回退到标准库
+    from lxml import etree as ET
+except ImportError:
+    import xml.etree.ElementTree as ET
+
+try:
+    # pybase64 使用 SIMD 加速 base64 编解码，未安装时回退到标准库
+    import pybase64 as b64
+except ImportError:
+    b64 = base64
+
+# UI 层级中 bounds 属性的格式：[left,top][right,bottom]
+_BOUNDS_RE = re.compile(r'\[(-?\d+),(-?\d+)\]\[(-?\d+),(-?\d+)\]')
+
+
+def _invalidates_hierarchy(method):
+    """装饰会改变界面的操作：执行后清除 UI 层级缓存"""
+    @functools.wraps(method)
+    def wrapper(self, *args, **kwargs):
+        try:
+            return method(self, *args, **kwargs)
+        finally:
+            self._hierarchy_cache = None
+    return wrapper
 
 
 class DeviceService:
@@ -14,21 +49,64 @@ class DeviceService:
     _instance = None
     _device: Optional[u2.Device] = None
     
+    # 最多缓存的截图数量（供前端通过 screenshot_id 拉取）
+    SCREENSHOT_CACHE_SIZE = 8
+    
+    # 预览图短边像素和 JPEG 质量（前端预览无需原始分辨率的 PNG）
+    PREVIEW_SHORT_SIDE = 720
+    PREVIEW_QUALITY = 75
+    
+    # 设备端截图的 JPEG 质量（与 uiautomator2 screenshot() 默认一致）
+    SCREENSHOT_JPEG_QUALITY = 80
+    
+    # 设备列表缓存有效期（秒），吸收前端短时间内的重复查询
+    DEVICES_CACHE_TTL = 1.5
+    _devices_cache = None  # (时间戳, 设备列表)
+    
+    # batch_shell 中分隔各条命令输出的标记
+    _SHELL_MARKER = '__AIDUT_SHELL_SEP__'
+    
+    # UI 层级缓存有效期（秒），任何会改变界面的操作都会使缓存失效
+    HIERARCHY_CACHE_TTL = 0.25
+    
     def __new__(cls):
         """单例模式，确保只有一个设备连接"""
         if cls._instance is None:
             cls._instance = super().__new__(cls)
+            cls._instance._screenshot_cache = OrderedDict()
+            cls._instance._screenshot_lock = threading.Lock()
+            cls._instance._device_info_cache = {}
+            cls._instance._hierarchy_cache = None  # (时间戳, XML)
+            # 并行执行互不依赖的设备查询（adb shell 与 uiautomator2 JSON-RPC 走不同通道）
+            cls._instance._pool = ThreadPoolExecutor(max_workers=2, thread_name_prefix='device')
         return cls._instance
     
-    @staticmethod
-    def list_devices() -> List[Dict[str, str]]:
+    @classmethod
+    def list_devices(cls) -> List[Dict[str, str]]:
         """
         获取已连接的 ADB 设备列表
         
         Returns:
             设备列表，每个设备包含 serial 和 status
         """
-        devices = []
+        cached = cls._devices_cache
+        if cached is not None and time.monotonic() - cached[0] < cls.DEVICES_CACHE_TTL:
+            return list(cached[1])
+        
+        # 优先直接与 adb server 通信；server 未启动时回退到 adb 命令（会自动拉起 server）
+        entries = adb_host.list_devices()
+        if entries is None:
+            entries = cls._list_devices_by_command()
+        
+        # 只返回状态为 device 的设备
+        devices = [{'serial': serial, 'status': status} for serial, status in entries if status == 'device']
+        cls._devices_cache = (time.monotonic(), devices)
+        return list(devices)
+    
+    @staticmethod
+    def _list_devices_by_command() -> List[Tuple[str, str]]:
+        """通过 adb devices 命令获取设备列表"""
+        entries = []
         try:
             result = subprocess.run(
                 ['adb', 'devices'],
@@ -40,18 +118,9 @@ class DeviceService:
             lines = result.stdout.strip().split('\n')
             # 跳过第一行 "List of devices attached"
             for line in lines[1:]:
-                line = line.strip()
-                if line and '\t' in line:
-                    parts = line.split('\t')
-                    if len(parts) >= 2:
-                        serial = parts[0].strip()
-                        status = parts[1].strip()
-                        # 只返回状态为 device 的设备
-                        if status == 'device':
-                            devices.append({
-                                'serial': serial,
-                                'status': status
-                            })
+                parts = line.strip().split('\t')
+                if len(parts) >= 2:
+                    entries.append((parts[0].strip(), parts[1].strip()))
         except subprocess.TimeoutExpired:
             pass
         except FileNotFoundError:
@@ -60,7 +129,7 @@ class DeviceService:
         except Exception:
             pass
         
-        return devices
+        return entries
     
     def connect(self, serial: Optional[str] = None) -> Dict[str, Any]:
         """
@@ -72,6 +141,7 @@ class DeviceService:
         Returns:
             设备信息字典
         """
+        self._hierarchy_cache = None
         if serial:
             self._device = u2.connect(serial)
         else:
@@ -81,7 +151,14 @@ class DeviceService:
     
     def disconnect(self):
         """断开设备连接"""
+        if self._device is not None:
+            self._device_info_cache.pop(self._device.serial, None)
         self._device = None
+        self._hierarchy_cache = None
+    
+    def get_serial(self) -> str:
+        """当前连接设备的序列号（未连接时为空字符串）"""
+        return self._device.serial if self._device is not None else ''
     
     def is_connected(self) -> bool:
         """检查设备是否已连接"""
@@ -96,24 +173,24 @@ class DeviceService:
         """获取设备信息"""
         self._ensure_connected()
         
+        serial = self._device.serial
+        
+        # 品牌、型号、系统版本在会话期间不会变化，按序列号缓存；
+        # 未缓存时通过 shell 获取，与 info / window_size 并行执行
+        props = self._device_info_cache.get(serial)
+        props_future = self._pool.submit(self._get_device_props) if props is None else None
+        
         # 使用 info 属性获取设备信息
         info = self._device.info
         # 使用 window_size() 获取屏幕尺寸
         window_size = self._device.window_size()
-        # 使用 shell 获取更多设备信息
-        serial = self._device.serial
         
-        # 通过 shell 命令获取设备品牌和型号
-        try:
-            brand = self._device.shell("getprop ro.product.brand").output.strip()
-            model = self._device.shell("getprop ro.product.model").output.strip()
-            sdk = self._device.shell("getprop ro.build.version.sdk").output.strip()
-            version = self._device.shell("getprop ro.build.version.release").output.strip()
-        except Exception:
-            brand = info.get('productName', '')
-            model = ''
-            sdk = str(info.get('sdkInt', ''))
-            version = ''
+        if props_future is not None:
+            props = props_future.result()
+            if props is None:
+                props = (info.get('productName', ''), '', str(info.get('sdkInt', '')), '')
+            self._device_info_cache[serial] = props
+        brand, model, sdk, version = props
         
         return {
             'serial': serial,
@@ -127,48 +204,173 @@ class DeviceService:
             }
         }
     
+    def _get_device_props(self) -> Optional[Tuple[str, str, str, str]]:
+        """
+        通过一次 shell 调用获取设备品牌、型号、SDK 版本和系统版本
+        
+        Returns:
+            (brand, model, sdk, version)，失败时返回 None
+        """
+        try:
+            outputs = self.batch_shell([
+                'getprop ro.product.brand',
+                'getprop ro.product.model',
+                'getprop ro.build.version.sdk',
+                'getprop ro.build.version.release'
+            ])
+            brand, model, sdk, version = (output.strip() for output in outputs)
+            return brand, model, sdk, version
+        except Exception:
+            return None
+    
     def get_screenshot(self) -> str:
         """
         获取设备截图
         
         Returns:
-            Base64编码的图片字符串
+            JPEG 图片的 data URI（data:image/jpeg;base64,...）；
+            设备端截图失败时回退为 PNG 的 data URI
+        """
+        # 设备端直接返回 base64 JPEG，无需解码再编码
+        screenshot_base64 = self._take_screenshot_base64()
+        if screenshot_base64:
+            return f"data:image/jpeg;base64,{screenshot_base64}"
+        return self.to_data_uri(self.get_screenshot_bytes())
+    
+    def get_screenshot_raw(self) -> Tuple[bytes, str]:
+        """
+        获取设备截图的原始数据（不经过 PIL 重新编码）
+        
+        Returns:
+            (图片字节数据, mimetype)，通常为 JPEG（'image/jpeg'），设备端截图失败时为 PNG（'image/png'）
+        """
+        screenshot_base64 = self._take_screenshot_base64()
+        if screenshot_base64:
+            return b64.b64decode(screenshot_base64), 'image/jpeg'
+        return self.get_screenshot_bytes(), 'image/png'
+    
+    def _take_screenshot_base64(self) -> Optional[str]:
+        """
+        通过 uiautomator2 的 JSON-RPC 获取设备端编码好的 JPEG（base64）
+        uiautomator2 的 screenshot() 本身也是解码这份 JPEG 得到 PIL 图像
+        
+        Returns:
+            base64 字符串，失败时返回 None（由调用方回退到 PIL 方式）
+        """
+        self._ensure_connected()
+        try:
+            return self._device.jsonrpc.takeScreenshot(1, self.SCREENSHOT_JPEG_QUALITY) or None
+        except Exception as e:
+            print(f"takeScreenshot 失败: {e}，使用内置方法")
+            return None
+    
+    def get_screenshot_bytes(self) -> bytes:
+        """
+        获取设备截图的 PNG 原始数据
+        
+        Returns:
+            PNG 字节数据
         """
         self._ensure_connected()
         
         # 获取截图 (返回 PIL.Image 对象)
         image = self._device.screenshot()
         
-        # 转换为base64
         buffer = BytesIO()
         image.save(buffer, format='PNG')
-        img_base64 = base64.b64encode(buffer.getvalue()).decode('utf-8')
-        
-        return f"data:image/png;base64,{img_base64}"
+        return buffer.getvalue()
     
-    def save_screenshot(self, filename: str):
-        """保存截图到文件"""
+    def get_screenshot_image(self):
+        """
+        获取设备截图
+        
+        Returns:
+            PIL.Image 对象（原始分辨率）
+        """
         self._ensure_connected()
-        self._device.screenshot(filename)
+        return self._device.screenshot()
     
-    def get_screenshot_file(self) -> str:
+    @staticmethod
+    def encode_jpeg(image, scale: float = 1.0, quality: int = 80) -> bytes:
         """
-        获取截图并保存到临时文件
+        按比例缩放截图并编码为 JPEG
         
+        Args:
+            image: PIL.Image 对象
+            scale: 缩放比例（>= 1 时不缩放）
+            quality: JPEG 质量
+            
         Returns:
-            临时文件路径
+            JPEG 字节数据
         """
-        self._ensure_connected()
+        if scale < 1:
+            width, height = image.size
+            image = image.resize((round(width * scale), round(height * scale)), Image.BILINEAR)
+        if image.mode != 'RGB':
+            image = image.convert('RGB')
         
-        # 创建临时文件
-        temp_dir = tempfile.gettempdir()
-        temp_file = os.path.join(temp_dir, 'aidut_screenshot.png')
+        buffer = BytesIO()
+        image.save(buffer, format='JPEG', quality=quality)
+        return buffer.getvalue()
+    
+    @classmethod
+    def encode_preview(cls, image, short_side: Optional[int] = None, quality: Optional[int] = None) -> bytes:
+        """
+        将截图缩小并编码为 JPEG，用于前端预览
         
-        # 保存截图
-        self._device.screenshot(temp_file)
+        Args:
+            image: PIL.Image 对象
+            short_side: 缩放后短边像素，默认 PREVIEW_SHORT_SIDE
+            quality: JPEG 质量，默认 PREVIEW_QUALITY
+            
+        Returns:
+            JPEG 字节数据
+        """
+        short_side = short_side or cls.PREVIEW_SHORT_SIDE
+        quality = quality or cls.PREVIEW_QUALITY
+        return cls.encode_jpeg(image, short_side / min(image.size), quality)
+    
+    @staticmethod
+    def to_data_uri(data: bytes, mimetype: str = 'image/png') -> str:
+        """将图片数据转换为 data URI"""
+        img_base64 = b64.b64encode(data).decode('ascii')
+        return f"data:{mimetype};base64,{img_base64}"
+    
+    def cache_screenshot(self, data: bytes, mimetype: str = 'image/png') -> str:
+        """
+        缓存截图数据，供前端按 ID 拉取
         
-        return temp_file
+        Args:
+            data: 图片字节数据
+            mimetype: 图片类型
+            
+        Returns:
+            截图ID（内容哈希，相同画面得到相同ID）
+        """
+        screenshot_id = hashlib.blake2b(data, digest_size=8).hexdigest()
+        with self._screenshot_lock:
+            self._screenshot_cache[screenshot_id] = (data, mimetype)
+            self._screenshot_cache.move_to_end(screenshot_id)
+            while len(self._screenshot_cache) > self.SCREENSHOT_CACHE_SIZE:
+                self._screenshot_cache.popitem(last=False)
+        return screenshot_id
+    
+    def get_cached_screenshot(self, screenshot_id: str) -> Optional[Tuple[bytes, str]]:
+        """
+        按 ID 获取缓存的截图
+        
+        Returns:
+            (图片字节数据, mimetype)，不存在或已淘汰时返回 None
+        """
+        with self._screenshot_lock:
+            return self._screenshot_cache.get(screenshot_id)
+    
+    def save_screenshot(self, filename: str):
+        """保存截图到文件"""
+        self._ensure_connected()
+        self._device.screenshot(filename)
     
+    @_invalidates_hierarchy
     def click(self, x: int, y: int):
         """
         点击指定坐标
@@ -180,6 +382,7 @@ class DeviceService:
         self._ensure_connected()
         self._device.click(x, y)
     
+    @_invalidates_hierarchy
     def double_click(self, x: int, y: int, duration: float = 0.1):
         """
         双击指定坐标
@@ -192,6 +395,7 @@ class DeviceService:
         self._ensure_connected()
         self._device.double_click(x, y, duration)
     
+    @_invalidates_hierarchy
     def long_click(self, x: int, y: int, duration: float = 0.5):
         """
         长按指定坐标
@@ -204,6 +408,7 @@ class DeviceService:
         self._ensure_connected()
         self._device.long_click(x, y, duration)
     
+    @_invalidates_hierarchy
     def swipe(self, start_x: int, start_y: int, end_x: int, end_y: int, duration: float = 0.5):
         """
         滑动操作
@@ -218,6 +423,7 @@ class DeviceService:
         self._ensure_connected()
         self._device.swipe(start_x, start_y, end_x, end_y, duration)
     
+    @_invalidates_hierarchy
     def swipe_ext(self, direction: str, scale: float = 0.8, duration: float = 0.5):
         """
         扩展滑动操作
@@ -230,6 +436,7 @@ class DeviceService:
         self._ensure_connected()
         self._device.swipe_ext(direction, scale=scale, duration=duration)
     
+    @_invalidates_hierarchy
     def drag(self, start_x: int, start_y: int, end_x: int, end_y: int, duration: float = 0.5):
         """
         拖拽操作
@@ -244,6 +451,7 @@ class DeviceService:
         self._ensure_connected()
         self._device.drag(start_x, start_y, end_x, end_y, duration)
     
+    @_invalidates_hierarchy
     def send_keys(self, text: str, clear: bool = False):
         """
         发送文本（需要先聚焦到输入框）
@@ -265,6 +473,7 @@ class DeviceService:
         self._ensure_connected()
         self._device.set_fastinput_ime(enable)
     
+    @_invalidates_hierarchy
     def press(self, key: Union[str, int]):
         """
         按键操作
@@ -278,26 +487,31 @@ class DeviceService:
         self._ensure_connected()
         self._device.press(key)
     
+    @_invalidates_hierarchy
     def home(self):
         """返回主屏幕"""
         self._ensure_connected()
         self._device.press("home")
     
+    @_invalidates_hierarchy
     def back(self):
         """返回上一页"""
         self._ensure_connected()
         self._device.press("back")
     
+    @_invalidates_hierarchy
     def recent(self):
         """打开最近任务"""
         self._ensure_connected()
         self._device.press("recent")
     
+    @_invalidates_hierarchy
     def screen_on(self):
         """点亮屏幕"""
         self._ensure_connected()
         self._device.screen_on()
     
+    @_invalidates_hierarchy
     def screen_off(self):
         """关闭屏幕"""
         self._ensure_connected()
@@ -308,16 +522,19 @@ class DeviceService:
         self._ensure_connected()
         return self._device.info.get('screenOn', False)
     
+    @_invalidates_hierarchy
     def unlock(self):
         """解锁屏幕"""
         self._ensure_connected()
         self._device.unlock()
     
+    @_invalidates_hierarchy
     def open_notification(self):
         """打开通知栏"""
         self._ensure_connected()
         self._device.open_notification()
     
+    @_invalidates_hierarchy
     def open_quick_settings(self):
         """打开快速设置"""
         self._ensure_connected()
@@ -333,83 +550,132 @@ class DeviceService:
         self._ensure_connected()
         self._device.set_clipboard(text)
     
-    def dump_hierarchy(self, use_adb: bool = True) -> str:
+    def dump_hierarchy(self, use_adb: bool = True, max_age: Optional[float] = None) -> str:
         """
         获取UI层级结构（XML格式）
         
         Args:
-            use_adb: 是否使用adb命令获取（更完整，推荐）
+            use_adb: 是否允许使用adb命令获取（需同时设置环境变量 AIDUT_FORCE_ADB_DUMP）
+            max_age: 可接受的缓存时长（秒），默认 HIERARCHY_CACHE_TTL；传 0 强制重新获取
             
         Returns:
             UI层级的XML字符串
         """
         self._ensure_connected()
         
-        if use_adb:
+        if max_age is None:
+            max_age = self.HIERARCHY_CACHE_TTL
+        cached = self._hierarchy_cache
+        if cached is not None and time.monotonic() - cached[0] < max_age:
+            return cached[1]
+        
+        hierarchy = self._dump_hierarchy(use_adb)
+        self._hierarchy_cache = (time.monotonic(), hierarchy)
+        return hierarchy
+    
+    def _dump_hierarchy(self, use_adb: bool) -> str:
+        """从设备获取 UI 层级（不经过缓存）"""
+        # 默认使用 uiautomator2 内置方法（一次 JSON-RPC 调用）；
+        # 环境变量 AIDUT_FORCE_ADB_DUMP 为 True 时才走 adb shell uiautomator dump
+        if use_adb and env_bool('AIDUT_FORCE_ADB_DUMP'):
             try:
-                # 使用 adb shell uiautomator dump 获取更完整的 UI 层级
                 dump_path = '/sdcard/ui_dump.xml'
                 
-                # 先删除旧文件
-                self._device.shell(f'rm -f {dump_path}')
-                
-                # dump UI hierarchy 到文件
-                result = self._device.shell(f'uiautomator dump {dump_path}')
-                
-                # 读取文件内容
-                xml_content = self._device.shell(f'cat {dump_path}').output
+                # 删除旧文件、dump、读取、清理合并为一次 shell 调用，减少 adb 往返
+                output = self._device.shell(
+                    f'rm -f {dump_path}; uiautomator dump {dump_path} >/dev/null; '
+                    f'cat {dump_path}; rm -f {dump_path}'
+                ).output
                 
-                # 清理临时文件
-                self._device.shell(f'rm -f {dump_path}')
-                
-                if xml_content and '<?xml' in xml_content:
-                    return xml_content.strip()
-                else:
-                    # 如果 adb 方式失败，回退到 uiautomator2 内置方法
-                    return self._device.dump_hierarchy()
-                    
+                # 去掉 XML 之前可能夹带的提示信息
+                xml_start = output.find('<?xml') if output else -1
+                if xml_start >= 0:
+                    return output[xml_start:].strip()
             except Exception as e:
                 print(f"adb dump_hierarchy 失败: {e}，使用内置方法")
-                return self._device.dump_hierarchy()
-        else:
-            return self._device.dump_hierarchy()
+        
+        return self._device.dump_hierarchy(compressed=False, pretty=False)
     
     def get_ui_elements(self) -> list:
         """
         获取所有UI元素信息
         
         Returns:
-            UI元素列表
+            UI元素列表，bounds 同时解析为 left/top/right/bottom 和点击中心 center_x/center_y
         """
         self._ensure_connected()
         
         hierarchy_xml = self.dump_hierarchy(use_adb=True)
-        root = ET.fromstring(hierarchy_xml)
         
         elements = []
-        
-        def parse_node(node, depth=0):
-            attribs = node.attrib
-            element = {
-                'class': attribs.get('class', ''),
-                'text': attribs.get('text', ''),
-                'resource_id': attribs.get('resource-id', ''),
-                'content_desc': attribs.get('content-desc', ''),
-                'clickable': attribs.get('clickable', 'false') == 'true',
-                'bounds': attribs.get('bounds', ''),
-                'depth': depth
-            }
+        depth = -1
+        # 流式遍历，用 start/end 事件维护深度，避免递归
+        for event, node in ET.iterparse(BytesIO(hierarchy_xml.encode('utf-8')), events=('start', 'end')):
+            if event == 'end':
+                depth -= 1
+                node.clear()
+                continue
+            depth += 1
             
-            # 只添加有意义的元素
-            if element['text'] or element['content_desc'] or element['clickable']:
-                elements.append(element)
+            text = node.get('text', '')
+            content_desc = node.get('content-desc', '')
+            clickable = node.get('clickable', 'false') == 'true'
             
-            for child in node:
-                parse_node(child, depth + 1)
+            # 只添加有意义的元素
+            if text or content_desc or clickable:
+                bounds = node.get('bounds', '')
+                match = _BOUNDS_RE.match(bounds)
+                left, top, right, bottom = map(int, match.groups()) if match else (0, 0, 0, 0)
+                elements.append({
+                    'class': node.get('class', ''),
+                    'text': text,
+                    'resource_id': node.get('resource-id', ''),
+                    'content_desc': content_desc,
+                    'clickable': clickable,
+                    'bounds': bounds,
+                    'left': left,
+                    'top': top,
+                    'right': right,
+                    'bottom': bottom,
+                    'center_x': (left + right) // 2,
+                    'center_y': (top + bottom) // 2,
+                    'depth': depth
+                })
         
-        parse_node(root)
         return elements
     
+    def get_ui_elements_soa(self) -> Dict[str, Any]:
+        """
+        获取所有UI元素信息（列式结构，便于用 numpy 批量筛选）
+        
+        Returns:
+            {'class': [...], 'text': [...], 'resource_id': [...], 'content_desc': [...],
+             'clickable': bool 数组, 'depth': int32 数组,
+             'bounds_left' / 'bounds_top' / 'bounds_right' / 'bounds_bottom': int32 数组}
+            第 i 个下标对应 get_ui_elements() 的第 i 个元素
+        """
+        elements = self.get_ui_elements()
+        count = len(elements)
+        
+        # bounds 已在 get_ui_elements 中解析为整数
+        bounds = np.array(
+            [(element['left'], element['top'], element['right'], element['bottom']) for element in elements],
+            dtype=np.int32
+        ).reshape(count, 4)
+        
+        return {
+            'class': [element['class'] for element in elements],
+            'text': [element['text'] for element in elements],
+            'resource_id': [element['resource_id'] for element in elements],
+            'content_desc': [element['content_desc'] for element in elements],
+            'clickable': np.fromiter((element['clickable'] for element in elements), dtype=bool, count=count),
+            'depth': np.fromiter((element['depth'] for element in elements), dtype=np.int32, count=count),
+            'bounds_left': bounds[:, 0],
+            'bounds_top': bounds[:, 1],
+            'bounds_right': bounds[:, 2],
+            'bounds_bottom': bounds[:, 3]
+        }
+    
     def find(self, **kwargs):
         """
         通用元素查找
@@ -472,6 +738,7 @@ class DeviceService:
         self._ensure_connected()
         return self._device(**kwargs).wait_gone(timeout=timeout)
     
+    @_invalidates_hierarchy
     def click_element(self, **kwargs) -> bool:
         """
         通过选择器点击元素
@@ -498,6 +765,7 @@ class DeviceService:
             'activity': current.get('activity', '')
         }
     
+    @_invalidates_hierarchy
     def app_start(self, package: str, activity: Optional[str] = None, wait: bool = True):
         """
         启动应用
@@ -510,11 +778,13 @@ class DeviceService:
         self._ensure_connected()
         self._device.app_start(package, activity=activity, wait=wait)
     
+    @_invalidates_hierarchy
     def app_stop(self, package: str):
         """停止应用"""
         self._ensure_connected()
         self._device.app_stop(package)
     
+    @_invalidates_hierarchy
     def app_clear(self, package: str):
         """清除应用数据"""
         self._ensure_connected()
@@ -558,6 +828,7 @@ class DeviceService:
         pid = self._device.app_wait(package, timeout=timeout, front=front)
         return pid is not None
     
+    @_invalidates_hierarchy
     def shell(self, cmd: str) -> str:
         """
         执行shell命令
@@ -572,6 +843,31 @@ class DeviceService:
         result = self._device.shell(cmd)
         return result.output if hasattr(result, 'output') else str(result)
     
+    @_invalidates_hierarchy
+    def batch_shell(self, cmds: List[str]) -> List[str]:
+        """
+        在一次 adb shell 往返中依次执行多条命令
+        
+        Args:
+            cmds: 命令列表（按顺序执行，前一条失败不影响后一条）
+            
+        Returns:
+            每条命令的输出，与 cmds 一一对应
+        """
+        self._ensure_connected()
+        # 每条命令后先输出一个换行再输出标记，命令输出末尾没有换行（如 printf、echo -n）时标记仍独占一行
+        separator = f' ; echo ; echo {self._SHELL_MARKER}'
+        output = self._device.shell(''.join(f'{cmd}{separator} ; ' for cmd in cmds)).output
+        if not output.endswith('\n'):
+            output += '\n'
+        
+        # 按标记行拆分各条命令的输出，最后一个标记之后应为空
+        segments = output.split(f'\n{self._SHELL_MARKER}\n')
+        if len(segments) != len(cmds) + 1 or segments[-1]:
+            raise RuntimeError(f"batch_shell 输出无法按命令拆分: 期望 {len(cmds)} 段，实际 {len(segments) - 1} 段")
+        # 去掉命令输出自身末尾的一个换行（与逐条执行 shell 命令时的输出一致）
+        return [segment.removesuffix('\n') for segment in segments[:-1]]
+    
     def push(self, src: str, dst: str):
         """推送文件到设备"""
         self._ensure_connected()
@@ -587,6 +883,7 @@ class DeviceService:
         self._ensure_connected()
         return self._device.window_size()
     
+    @_invalidates_hierarchy
     def open_url(self, url: str):
         """在浏览器中打开URL"""
         self._ensure_connected()
@@ -1,55 +1,35 @@
 import os
-import json
+import re
+import copy
+import heapq
+import hashlib
+import threading
+from collections import OrderedDict
+from io import BytesIO
 from typing import Optional, Dict, Any, List
+import httpx
+import orjson
 from openai import OpenAI
 from flask import current_app
-from app.services.preset_service import PresetService
+from app.services.preset_service import get_preset_service
+from app.services.cache_service import CacheService
+from config import Config
 
+try:
+    # lxml 的 C 解析器更快，未安装时回退到标准库
+    from lxml import etree as ET
+except ImportError:
+    import xml.etree.ElementTree as ET
 
-class LLMService:
-    """大模型对话服务 - Agent模式"""
-    
-    _instance = None
-    _history: List[Dict[str, str]] = []
-    
-    def __new__(cls):
-        """单例模式"""
-        if cls._instance is None:
-            cls._instance = super().__new__(cls)
-            cls._instance._history = []
-            cls._instance._preset_service = None
-        return cls._instance
-    
-    def _get_preset_service(self) -> PresetService:
-        """获取预设服务（延迟初始化）"""
-        if self._preset_service is None:
-            self._preset_service = PresetService()
-        return self._preset_service
-    
-    def _get_client(self) -> OpenAI:
-        """获取OpenAI客户端"""
-        api_key = os.getenv('LLM_API_KEY') or current_app.config.get('LLM_API_KEY')
-        base_url = os.getenv('LLM_BASE_URL') or current_app.config.get('LLM_BASE_URL')
-        
-        if not api_key:
-            raise ValueError("请配置 LLM_API_KEY")
-        
-        return OpenAI(
-            api_key=api_key,
-            base_url=base_url
-        )
-    
-    def _get_model(self) -> str:
-        """获取模型名称"""
-        return os.getenv('LLM_MODEL') or current_app.config.get('LLM_MODEL', 'gpt-4o')
-    
-    def _build_system_prompt(self) -> str:
-        """构建系统提示词 - Agent模式"""
-        # 获取 APP 包名映射表
-        preset_service = self._get_preset_service()
-        app_packages = preset_service.format_app_packages_for_ai()
-        
-        return f"""你是一个Android手机自动化助手。根据用户指令和当前屏幕状态，一步一步完成任务。
+# 模型名中包含这些标记时认为支持图片输入
+_VISION_MODEL_TAGS = ('gpt-4', 'vision', 'qwen-vl', 'glm-4v')
+
+# 从 AI 响应中提取 JSON 对象
+_JSON_OBJECT_RE = re.compile(r'\{[\s\S]*\}')
+
+
+# 系统提示词模板 - Agent模式（{app_packages} 为 APP 包名映射表）
+_SYSTEM_PROMPT_TEMPLATE = """你是一个Android手机自动化助手。根据用户指令和当前屏幕状态，一步一步完成任务。
 
 重要规则：
 1. 每次只返回一个操作
@@ -141,6 +121,200 @@ class LLMService:
 严格按JSON格式返回，无其他内容：
 {{"status": "action/completed/failed", "action": {{...}}, "message": "说明"}}
 """
+
+
+def _ocr_position_key(elem: Dict[str, Any]) -> tuple:
+    """OCR 结果排序键：从上到下、从左到右"""
+    bounds = elem['bounds']
+    return bounds['top'], bounds['left']
+
+
+class LLMService:
+    """大模型对话服务 - Agent模式"""
+    
+    _instance = None
+    _history: List[Dict[str, str]] = []
+    
+    # 大模型 HTTP 连接池：所有请求共享，保持长连接，避免每一步都重新建立 TLS 连接
+    HTTP_TIMEOUT = 60.0
+    HTTP_LIMITS = httpx.Limits(max_connections=16, max_keepalive_connections=16)
+    
+    # 响应缓存条数（完全相同的提示词 + 截图直接复用上次的决策）
+    RESPONSE_CACHE_SIZE = 256
+    # 响应缓存在持久化缓存中的命名空间和最多保留条数（有效期见 Config.LLM_RESPONSE_CACHE_TTL）
+    RESPONSE_CACHE_NAMESPACE = 'llm_response'
+    RESPONSE_CACHE_MAX_ROWS = 2000
+    
+    def __new__(cls):
+        """单例模式"""
+        if cls._instance is None:
+            cls._instance = super().__new__(cls)
+            cls._instance._history = []
+            cls._instance._system_message_cache = None  # ((APP包名映射表, 缓存开关), 系统消息)
+            cls._instance._response_cache = OrderedDict()
+            cls._instance._response_cache_lock = threading.Lock()
+            # 持久化缓存可通过 LLM_RESPONSE_CACHE_PERSIST=False 关闭（只保留内存 LRU）
+            cls._instance._persistent_cache = CacheService() if Config.LLM_RESPONSE_CACHE_PERSIST else None
+            cls._instance._http_client = httpx.Client(timeout=cls.HTTP_TIMEOUT, limits=cls.HTTP_LIMITS)
+            cls._instance._client = None
+            cls._instance._client_key = None  # (api_key, base_url)
+            cls._instance._config = None  # 大模型配置快照
+            cls._instance._vision_cache = {}  # 模型名 -> 是否支持图片输入
+        return cls._instance
+    
+    def _get_config(self) -> Dict[str, Any]:
+        """
+        读取大模型配置（环境变量优先，其次是应用配置）
+        首次读取后缓存在实例上，配置修改后调用 refresh_config() 重新读取；未配置 API Key 时不缓存
+        """
+        config = self._config
+        if config is None:
+            app_config = current_app.config
+            config = {
+                'api_key': os.getenv('LLM_API_KEY') or app_config.get('LLM_API_KEY'),
+                'base_url': os.getenv('LLM_BASE_URL') or app_config.get('LLM_BASE_URL'),
+                'model': os.getenv('LLM_MODEL') or app_config.get('LLM_MODEL', 'gpt-4o'),
+                'prompt_cache': app_config.get('LLM_PROMPT_CACHE', False)
+            }
+            if config['api_key']:
+                self._config = config
+        return config
+    
+    def refresh_config(self):
+        """丢弃缓存的配置和客户端，下次调用时重新读取"""
+        self._config = None
+        self.reset_client()
+    
+    def _get_client(self) -> OpenAI:
+        """获取OpenAI客户端"""
+        config = self._get_config()
+        api_key = config['api_key']
+        base_url = config['base_url']
+        
+        if not api_key:
+            raise ValueError("请配置 LLM_API_KEY")
+        
+        # 配置不变时复用同一个客户端
+        client_key = (api_key, base_url)
+        if self._client is None or self._client_key != client_key:
+            self._client = OpenAI(
+                api_key=api_key,
+                base_url=base_url,
+                http_client=self._http_client
+            )
+            self._client_key = client_key
+        return self._client
+    
+    def reset_client(self):
+        """丢弃缓存的 OpenAI 客户端（下次调用时按当前配置重新创建）"""
+        self._client = None
+        self._client_key = None
+    
+    def _get_model(self) -> str:
+        """获取模型名称"""
+        return self._get_config()['model']
+    
+    def model_supports_vision(self, model: Optional[str] = None) -> bool:
+        """
+        判断模型是否支持图片输入（按模型名缓存结果）
+        
+        Args:
+            model: 模型名称，默认为当前配置的模型
+        """
+        if model is None:
+            model = self._get_model()
+        supported = self._vision_cache.get(model)
+        if supported is None:
+            name = model.lower()
+            supported = any(tag in name for tag in _VISION_MODEL_TAGS)
+            self._vision_cache[model] = supported
+        return supported
+    
+    @staticmethod
+    def _response_cache_key(model: str, messages: List[Dict[str, Any]]) -> str:
+        """根据模型和完整消息内容（含截图）计算缓存键"""
+        hasher = hashlib.sha256(model.encode('utf-8'))
+        for message in messages:
+            content = message['content']
+            parts = content if isinstance(content, list) else [{"type": "text", "text": content}]
+            for part in parts:
+                value = part['text'] if part['type'] == 'text' else part['image_url']['url']
+                hasher.update(b'\x00')
+                hasher.update(value.encode('utf-8'))
+        return hasher.hexdigest()
+    
+    def _get_cached_response(self, key: str) -> Optional[Dict[str, Any]]:
+        """
+        查找响应缓存，返回副本避免调用方修改缓存内容
+        先查内存 LRU，未命中再查持久化缓存（进程重启后依然有效）
+        """
+        with self._response_cache_lock:
+            result = self._response_cache.get(key)
+            if result is not None:
+                self._response_cache.move_to_end(key)
+                return copy.deepcopy(result)
+        
+        if self._persistent_cache is None:
+            return None
+        result = self._persistent_cache.get(
+            self.RESPONSE_CACHE_NAMESPACE, key, max_age=Config.LLM_RESPONSE_CACHE_TTL
+        )
+        if result is not None:
+            self._remember_response(key, result)
+        return result
+    
+    def _remember_response(self, key: str, result: Dict[str, Any]):
+        """写入内存 LRU"""
+        with self._response_cache_lock:
+            self._response_cache[key] = copy.deepcopy(result)
+            self._response_cache.move_to_end(key)
+            while len(self._response_cache) > self.RESPONSE_CACHE_SIZE:
+                self._response_cache.popitem(last=False)
+    
+    def _cache_response(self, key: str, result: Dict[str, Any]):
+        """缓存响应（只缓存需要执行操作的结果，完成/失败的判断每次都重新询问）"""
+        if result.get('status') != 'action':
+            return
+        self._remember_response(key, result)
+        if self._persistent_cache is not None:
+            self._persistent_cache.set(
+                self.RESPONSE_CACHE_NAMESPACE, key, result,
+                max_age=Config.LLM_RESPONSE_CACHE_TTL, max_entries=self.RESPONSE_CACHE_MAX_ROWS
+            )
+    
+    def clear_response_cache(self):
+        """清空响应缓存（包括持久化缓存）"""
+        with self._response_cache_lock:
+            self._response_cache.clear()
+        if self._persistent_cache is not None:
+            self._persistent_cache.clear(self.RESPONSE_CACHE_NAMESPACE)
+    
+    def _build_system_message(self) -> Dict[str, Any]:
+        """
+        构建系统消息（按 APP 包名映射表和缓存开关记忆，内容不变时复用同一个消息对象）
+        开启 LLM_PROMPT_CACHE 时为系统提示词加上 cache_control 标记（Anthropic 兼容接口的显式前缀缓存），
+        OpenAI 对 1024 tokens 以上的相同前缀会自动缓存，无需标记
+        """
+        app_packages = get_preset_service().format_app_packages_for_ai()
+        prompt_cache = self._get_config()['prompt_cache']
+        
+        cached = self._system_message_cache
+        if cached is not None and cached[0] == (app_packages, prompt_cache):
+            return cached[1]
+        
+        system_prompt = self._build_system_prompt(app_packages)
+        if prompt_cache:
+            content = [{"type": "text", "text": system_prompt, "cache_control": {"type": "ephemeral"}}]
+        else:
+            content = system_prompt
+        message = {"role": "system", "content": content}
+        self._system_message_cache = ((app_packages, prompt_cache), message)
+        return message
+    
+    @staticmethod
+    def _build_system_prompt(app_packages: str) -> str:
+        """构建系统提示词 - Agent模式"""
+        return _SYSTEM_PROMPT_TEMPLATE.format(app_packages=app_packages)
     
     def analyze_and_act(
         self,
@@ -169,19 +343,18 @@ class LLMService:
             step_number: 当前步骤编号
             action_history: 历史操作摘要列表
         """
-        client = self._get_client()
         model = self._get_model()
         
         # 构建用户消息
+        # 稳定内容在前、每步变化的内容在后，使提供方的前缀缓存能命中更长的前缀
         user_message = f"用户任务: {task}\n"
-        user_message += f"当前是第 {step_number} 步\n"
         
         # 获取当前APP包名
         current_package = current_app.get('package', '') if current_app else ''
         
         # 根据当前APP获取预设列表（每一步都发送，确保AI不会忘记）
         preset_info = ""
-        preset_service = self._get_preset_service()
+        preset_service = get_preset_service()
         
         # 从当前APP获取预设
         if current_package:
@@ -202,6 +375,8 @@ class LLMService:
         if preset_info:
             user_message += f"\n{preset_info}\n"
         
+        user_message += f"当前是第 {step_number} 步\n"
+        
         if current_app:
             package = current_app.get('package', '未知')
             activity = current_app.get('activity', '')
@@ -241,12 +416,10 @@ class LLMService:
         user_message += "\n请分析当前屏幕，决定下一步操作。优先使用UI布局的bounds计算点击坐标。只返回JSON格式。"
         
         # 构建消息
-        messages = [
-            {"role": "system", "content": self._build_system_prompt()}
-        ]
+        messages = [self._build_system_message()]
         
         # 添加图片（如果支持视觉模型）
-        if screenshot and ('gpt-4' in model or 'vision' in model.lower() or 'qwen-vl' in model.lower() or 'glm-4v' in model.lower()):
+        if screenshot and self.model_supports_vision(model):
             messages.append({
                 "role": "user",
                 "content": [
@@ -257,7 +430,15 @@ class LLMService:
         else:
             messages.append({"role": "user", "content": user_message})
         
+        # 相同屏幕 + 相同上下文（提示词逐字一致）时直接复用之前的决策
+        cache_key = self._response_cache_key(model, messages)
+        cached = self._get_cached_response(cache_key)
+        if cached is not None:
+            cached['debug']['cached'] = True
+            return cached
+        
         # 调用API
+        client = self._get_client()
         response = client.chat.completions.create(
             model=model,
             messages=messages,
@@ -277,17 +458,21 @@ class LLMService:
             'raw_response': assistant_message,
             'has_screenshot': screenshot is not None,
             'has_ui_hierarchy': ui_hierarchy is not None,
-            'has_preset': bool(preset_info)
+            'has_preset': bool(preset_info),
+            'cached': False
         }
         
+        self._cache_response(cache_key, result)
+        
         return result
     
-    def _summarize_ocr(self, ocr_result: Dict[str, Any]) -> str:
+    def _summarize_ocr(self, ocr_result: Dict[str, Any], max_elements: Optional[int] = None) -> str:
         """
-        格式化OCR识别结果，供AI分析使用（返回全部高置信度结果）
+        格式化OCR识别结果，供AI分析使用（默认返回全部高置信度结果）
         
         Args:
             ocr_result: OCR识别结果字典
+            max_elements: 最多保留的结果数量（按位置取最靠上的），None 表示不限制
             
         Returns:
             格式化的OCR文字信息
@@ -299,65 +484,75 @@ class LLMService:
         if not elements:
             return "屏幕上未识别到文字"
         
-        # 按从上到下、从左到右排序
-        elements = sorted(elements, key=lambda x: (x['bounds']['top'], x['bounds']['left']))
-        
-        lines = []
-        for i, elem in enumerate(elements, 1):
-            text = elem['text']
-            center = elem['center']
-            confidence = elem.get('confidence', 0)
-            
-            # 只显示置信度 >= 0.5 的结果
-            if confidence >= 0.5:
-                lines.append(f'{i}. "{text}" -> 点击坐标({center[0]}, {center[1]})')
-        
-        if not lines:
+        # 先过滤，只显示置信度 >= 0.5 的结果，再对剩余结果排序
+        elements = [elem for elem in elements if elem.get('confidence', 0) >= 0.5]
+        if not elements:
             return "屏幕上未识别到高置信度的文字"
         
-        return '\n'.join(lines)
+        # 按从上到下、从左到右排序
+        if max_elements is not None and len(elements) > max_elements:
+            elements = heapq.nsmallest(max_elements, elements, key=_ocr_position_key)
+        else:
+            elements.sort(key=_ocr_position_key)
+        
+        return '\n'.join([
+            f'{i}. "{elem["text"]}" -> 点击坐标({elem["center"][0]}, {elem["center"][1]})'
+            for i, elem in enumerate(elements, 1)
+        ])
     
-    def _summarize_ui(self, ui_hierarchy: str) -> str:
-        """
-        提取UI层级中的全部关键信息（返回全部元素）
+    def _summarize_ui(
+        self,
+        ui_hierarchy: str,
+        max_elements: Optional[int] = None,
+        max_length: Optional[int] = None
+    ) -> str:
         """
-        import xml.etree.ElementTree as ET
+        提取UI层级中的关键信息
         
+        Args:
+            ui_hierarchy: UI层级 XML
+            max_elements: 最多提取的元素数量，达到后停止解析剩余部分；None 表示返回全部元素
+            max_length: 结果的最大字符数，超出前停止解析剩余部分；None 表示不限制
+        """
         try:
-            root = ET.fromstring(ui_hierarchy)
             elements = []
+            length = 0
             
-            def extract_elements(node, depth=0):
-                attribs = node.attrib
-                text = attribs.get('text', '').strip()
-                desc = attribs.get('content-desc', '').strip()
-                resource_id = attribs.get('resource-id', '').strip()
-                clickable = attribs.get('clickable', 'false') == 'true'
-                bounds = attribs.get('bounds', '')
-                class_name = attribs.get('class', '').split('.')[-1]
+            # 流式遍历（start 事件时属性已可用），避免递归
+            for event, node in ET.iterparse(BytesIO(ui_hierarchy.encode('utf-8')), events=('start',)):
+                text = node.get('text', '').strip()
+                desc = node.get('content-desc', '').strip()
+                resource_id = node.get('resource-id', '').strip()
+                clickable = node.get('clickable', 'false') == 'true'
                 
                 # 提取有意义的元素（有文字、描述、或可点击）
-                if text or desc or clickable or resource_id:
-                    info_parts = []
-                    if text:
-                        info_parts.append(f'text="{text}"')
-                    if desc:
-                        info_parts.append(f'desc="{desc}"')
-                    if resource_id:
-                        short_id = resource_id.split('/')[-1] if '/' in resource_id else resource_id
-                        info_parts.append(f'id="{short_id}"')
-                    if clickable:
-                        info_parts.append('clickable')
-                    if bounds:
-                        info_parts.append(f'bounds={bounds}')
-                    
-                    if info_parts:  # 确保有内容才添加
-                        elements.append(f"[{class_name}] {' '.join(info_parts)}")
+                if not (text or desc or clickable or resource_id):
+                    continue
                 
-                for child in node:
-                    extract_elements(child, depth + 1)
-            
-            extract_elements(root)
+                info_parts = []
+                if text:
+                    info_parts.append(f'text="{text}"')
+                if desc:
+                    info_parts.append(f'desc="{desc}"')
+                if resource_id:
+                    short_id = resource_id.split('/')[-1] if '/' in resource_id else resource_id
+                    info_parts.append(f'id="{short_id}"')
+                if clickable:
+                    info_parts.append('clickable')
+                bounds = node.get('bounds', '')
+                if bounds:
+                    info_parts.append(f'bounds={bounds}')
+                
+                class_name = node.get('class', '').split('.')[-1]
+                line = f"[{class_name}] {' '.join(info_parts)}"
+                # 边生成边累计长度（含换行符），超出预算时不再继续解析
+                if max_length is not None:
+                    length += len(line) + (1 if elements else 0)
+                    if length > max_length:
+                        break
+                elements.append(line)
+                if max_elements is not None and len(elements) >= max_elements:
+                    break
             
             return '\n'.join(elements)
             
@@ -368,42 +563,33 @@ class LLMService:
         """
         解析AI响应
         """
+        response = response.strip()
+        
+        # 移除可能的markdown代码块标记（去掉首行的 ```json 和结尾的 ```）
+        if response.startswith('```'):
+            response = response.partition('\n')[2].removesuffix('```').strip()
+        
         try:
-            response = response.strip()
-            
-            # 移除可能的markdown代码块标记
-            if response.startswith('```'):
-                lines = response.split('\n')
-                response = '\n'.join(lines[1:-1] if lines[-1] == '```' else lines[1:])
-                response = response.strip()
-            
-            result = json.loads(response)
-            
-            if 'status' not in result:
-                result['status'] = 'action' if 'action' in result else 'failed'
-            if 'message' not in result:
-                result['message'] = ''
-            
-            return result
-            
-        except json.JSONDecodeError:
-            import re
-            json_match = re.search(r'\{[\s\S]*\}', response)
-            if json_match:
-                try:
-                    result = json.loads(json_match.group())
-                    if 'status' not in result:
-                        result['status'] = 'action' if 'action' in result else 'failed'
-                    if 'message' not in result:
-                        result['message'] = ''
-                    return result
-                except:
-                    pass
-            
+            result = orjson.loads(response)
+        except orjson.JSONDecodeError:
+            json_match = _JSON_OBJECT_RE.search(response)
+            try:
+                result = orjson.loads(json_match.group()) if json_match else None
+            except orjson.JSONDecodeError:
+                result = None
+        
+        if not isinstance(result, dict):
             return {
                 'status': 'failed',
                 'message': f'无法解析AI响应: {response[:200]}'
             }
+        
+        if 'status' not in result:
+            result['status'] = 'action' if 'action' in result else 'failed'
+        if 'message' not in result:
+            result['message'] = ''
+        
+        return result
     
     def get_history(self) -> List[Dict[str, str]]:
         """获取对话历史"""
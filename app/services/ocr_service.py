@@ -1,24 +1,168 @@
+import os
 import time
+import queue
+import hashlib
+import threading
 import traceback
+from collections import OrderedDict
 import cv2
-from paddleocr import PaddleOCR
+import numpy as np
 import logging
 
 
+class ImageReadError(ValueError):
+    """图片无法读取/解码"""
+
+
+class _RapidOcrEngine:
+    """
+    RapidOCR（PP-OCR 模型的 ONNX Runtime 版本）适配器
+    对外提供与 PaddleOCR 相同的 ocr(img, cls=False) 返回格式：[[[box, (text, score)], ...]]
+    """
+
+    def __init__(self, det_model_dir=None, rec_model_dir=None, cpu_threads=None):
+        from rapidocr_onnxruntime import RapidOCR
+
+        options = {}
+        if det_model_dir:
+            options['det_model_path'] = det_model_dir
+        if rec_model_dir:
+            options['rec_model_path'] = rec_model_dir
+        if cpu_threads:
+            options['intra_op_num_threads'] = int(cpu_threads)
+        self._engine = RapidOCR(**options)
+
+    def ocr(self, img, cls=False):
+        result, _ = self._engine(img, use_cls=cls)
+        if not result:
+            return [None]
+        return [[[box, (text, float(score))] for box, text, score in result]]
+
+
 class ocr_service():
-    def __init__(self, lang='ch'):
+    # 识别结果缓存条数（按图片内容哈希，同一画面重复识别时直接返回）
+    RESULT_CACHE_SIZE = 32
+
+    def __init__(self, lang='ch', det_model_dir=None, rec_model_dir=None, cpu_threads=None, cpu_affinity=None,
+                 backend=None, max_side=None):
+        """
+        :param det_model_dir: 检测模型目录，可指向量化(slim)模型，默认读取环境变量 OCR_DET_MODEL_DIR
+        :param rec_model_dir: 识别模型目录，可指向量化(slim)模型，默认读取环境变量 OCR_REC_MODEL_DIR
+        :param cpu_threads: 推理线程数，默认读取环境变量 OCR_CPU_THREADS（未设置时使用 PaddleOCR 默认值）
+        :param cpu_affinity: 绑定的 CPU 核心，如 "0,1"，默认读取环境变量 OCR_CPU_AFFINITY
+                             仅 Linux 有效，作用于创建 OCR 的线程及其后续创建的推理线程
+        :param backend: 推理后端，'paddle'（默认）或 'rapidocr'（ONNX Runtime），默认读取环境变量 OCR_BACKEND
+                        使用 rapidocr 时 det/rec 模型目录应指向对应的 .onnx 模型文件
+        :param max_side: 识别前将图片长边缩小到该像素数以内，默认读取环境变量 OCR_MAX_SIDE（未设置时不缩放）
+                         检测模型内部已将长边限制在 960，缩放主要减少内存和预处理耗时，过小会影响小字识别
+        """
         log = logging.getLogger('ppocr')
         log.setLevel('ERROR')
 
+        det_model_dir = det_model_dir or os.getenv('OCR_DET_MODEL_DIR') or None
+        rec_model_dir = rec_model_dir or os.getenv('OCR_REC_MODEL_DIR') or None
+        cpu_threads = cpu_threads or os.getenv('OCR_CPU_THREADS')
+        cpu_affinity = cpu_affinity or os.getenv('OCR_CPU_AFFINITY')
+        backend = (backend or os.getenv('OCR_BACKEND') or 'paddle').lower()
+        self.max_side = int(max_side or os.getenv('OCR_MAX_SIDE') or 0)
+
+        if cpu_affinity and hasattr(os, 'sched_setaffinity'):
+            try:
+                os.sched_setaffinity(0, {int(cpu) for cpu in str(cpu_affinity).split(',') if cpu.strip()})
+            except (ValueError, OSError) as e:
+                print(f"OCR 绑定 CPU 核心失败: {e}")
+
+        self._result_cache = OrderedDict()
+        self._result_cache_lock = threading.Lock()
+
+        if backend == 'rapidocr':
+            # ONNX Runtime 推理，同样使用 PP-OCR 模型，CPU 上通常更快
+            self.ocr_v3 = _RapidOcrEngine(det_model_dir, rec_model_dir, cpu_threads)
+            return
+
+        from paddleocr import PaddleOCR
+
+        options = {}
+        if cpu_threads:
+            options['cpu_threads'] = int(cpu_threads)
+
         # 百度飞浆OCR  ocr_version="PP-OCR" 可选模型，当前用的是v3准确率最高
+        # 指定 det/rec 模型目录时可换用 int8 量化的 slim 模型，配合 mkldnn 在 CPU 上推理更快
+        # 每次只识别一张截图，识别/分类 batch 设为 1，CPU 上速度不变但 mkldnn 常驻内存大幅减少
         self.ocr_v3 = PaddleOCR(use_gpu=False, lang=lang, ocr_version="PP-OCRv3", use_angle_cls=False,
-                                enable_mkldnn=True)
+                                enable_mkldnn=True, det_model_dir=det_model_dir, rec_model_dir=rec_model_dir,
+                                rec_batch_num=1, cls_batch_num=1, **options)
+
+    def _ocr_cached(self, img):
+        """
+        识别已解码的灰度图，结果按图片内容哈希缓存（LRU）
+        :param img: numpy 数组
+        :return: PaddleOCR 原始识别结果（单张图片），调用方不要修改
+        """
+        hasher = hashlib.blake2b(img.tobytes(), digest_size=16)
+        hasher.update(str(img.shape).encode())
+        key = hasher.digest()
+
+        with self._result_cache_lock:
+            if key in self._result_cache:
+                self._result_cache.move_to_end(key)
+                return self._result_cache[key]
+
+        result = self.ocr_v3.ocr(img, cls=False)[0]
+
+        with self._result_cache_lock:
+            self._result_cache[key] = result
+            while len(self._result_cache) > self.RESULT_CACHE_SIZE:
+                self._result_cache.popitem(last=False)
+        return result
+
+    @staticmethod
+    def _load_gray_image(image):
+        """
+        读取灰度图，支持图片路径、图片字节数据（PNG/JPEG 等）、PIL.Image 或已解码的 numpy 数组
+        内存中的截图直接解码，无需先落盘再读取
+        """
+        if hasattr(image, 'convert'):
+            # PIL.Image：直接转灰度，不经过编码/解码
+            return np.asarray(image.convert('L'))
+        if isinstance(image, np.ndarray):
+            if image.ndim == 3:
+                return cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+            return image
+        if isinstance(image, (bytes, bytearray, memoryview)):
+            return cv2.imdecode(np.frombuffer(image, np.uint8), cv2.IMREAD_GRAYSCALE)
+        return cv2.imread(image, cv2.IMREAD_GRAYSCALE)
+
+    def _run_ocr(self, image, roi=None):
+        """
+        读取图片（只解码一次）并识别，所有识别方法都通过这里调用模型
+        :param image: 图片路径、图片字节数据、PIL.Image 或已解码的 numpy 数组
+        :param roi: 只识别的区域 (x, y, w, h)
+        :return: PaddleOCR 原始识别结果（无结果时为空列表）
+        """
+        img = self._load_gray_image(image)
+        if img is None:
+            error_source = image if isinstance(image, str) else '内存图片数据'
+            raise ImageReadError(f"无法读取图片: {error_source}")
+        if roi:
+            x, y, width, height = roi
+            img = img[y:y + height, x:x + width]
+
+        # 长边超过 max_side 时先缩小再识别，识别框坐标再换算回原图
+        if self.max_side and max(img.shape[:2]) > self.max_side:
+            scale = self.max_side / max(img.shape[:2])
+            img = cv2.resize(img, None, fx=scale, fy=scale, interpolation=cv2.INTER_AREA)
+            result = self._ocr_cached(img) or []
+            # 缓存中的结果不能修改，生成新的列表
+            return [[(np.asarray(box, dtype=np.float32) / scale).tolist(), text_info] for box, text_info in result]
+
+        return self._ocr_cached(img) or []
 
     def get_all_text_with_positions(self, image_path):
         """
         识别图片中的所有文字并返回文字及其坐标信息
         用于将OCR结果传递给AI，而不是直接传递截图
-        :param image_path: 图片路径
+        :param image_path: 图片路径，也可以是图片字节数据、PIL.Image 或 numpy 数组
         :return: 包含所有文字及坐标的列表，格式为:
                  [
                      {
@@ -35,38 +179,24 @@ class ocr_service():
                      ...
                  ]
         """
-        ocr = self.ocr_v3
         result_list = []
         
         try:
-            # cv2读取图片
-            img = cv2.imread(image_path, 0)
-            if img is None:
-                return {"error": f"无法读取图片: {image_path}", "elements": []}
-            
-            result = ocr.ocr(img, cls=False)[0]
-            
-            if result is None:
-                return {"error": None, "elements": []}
+            result = self._run_ocr(image_path)
             
             for line in result:
                 # line[0] 是四个角点坐标 [[x1,y1], [x2,y2], [x3,y3], [x4,y4]]
                 # line[1] 是 (识别文字, 置信度)
-                points = line[0]
+                points = np.asarray(line[0], dtype=np.float32)
                 text = line[1][0]
                 confidence = line[1][1]
                 
-                # 计算边界框
-                x_coords = [p[0] for p in points]
-                y_coords = [p[1] for p in points]
-                left = min(x_coords)
-                right = max(x_coords)
-                top = min(y_coords)
-                bottom = max(y_coords)
+                # 计算边界框（四个角点按列取最小/最大值）
+                (left, top), (right, bottom) = points.min(axis=0), points.max(axis=0)
                 
                 # 计算中心点
-                center_x = (left + right) / 2
-                center_y = (top + bottom) / 2
+                center_x = (left + right) * 0.5
+                center_y = (top + bottom) * 0.5
                 
                 result_list.append({
                     "text": text,
@@ -82,14 +212,68 @@ class ocr_service():
             
             return {"error": None, "elements": result_list}
             
+        except ImageReadError as e:
+            # 图片本身无法读取是预期内的错误，其他异常打印堆栈便于排查
+            return {"error": str(e), "elements": []}
         except Exception as e:
             print(traceback.format_exc())
             return {"error": str(e), "elements": []}
 
+    def ocr_batch(self, image_paths):
+        """
+        流水线识别多张图片：后台线程预先读取下一张图片，当前线程执行 OCR
+        （PaddleOCR 不是线程安全的，同一时间只有一个线程使用模型）
+        :param image_paths: 图片路径列表（也可以是 get_all_text_with_positions 支持的其他图片类型）
+        :return: 生成器，按顺序产出与 get_all_text_with_positions 相同格式的结果
+        """
+        images = queue.Queue(maxsize=2)
+        stop = threading.Event()
+        end = object()
+
+        def produce():
+            for image_path in image_paths:
+                if stop.is_set():
+                    return
+                try:
+                    img = self._load_gray_image(image_path)
+                except Exception:
+                    print(traceback.format_exc())
+                    img = None
+                images.put((image_path, img))
+            images.put(end)
+
+        threading.Thread(target=produce, name='ocr-reader', daemon=True).start()
+        try:
+            while True:
+                item = images.get()
+                if item is end:
+                    return
+                image_path, img = item
+                if img is None:
+                    error_source = image_path if isinstance(image_path, str) else '内存图片数据'
+                    yield {"error": f"无法读取图片: {error_source}", "elements": []}
+                else:
+                    yield self.get_all_text_with_positions(img)
+        finally:
+            # 调用方提前结束时让读取线程退出：清空队列，避免其阻塞在 put 上
+            stop.set()
+            while not images.empty():
+                images.get_nowait()
+
+    def ocr_many(self, image_paths):
+        """
+        批量识别多张图片，一次返回全部结果
+        PaddleOCR 开启检测时不支持一次传入多张图片，这里复用 ocr_batch 的流水线：
+        读取/解码与推理重叠进行，始终使用同一个模型实例
+        :param image_paths: 图片路径列表（也可以是 get_all_text_with_positions 支持的其他图片类型）
+        :return: 结果列表，顺序与 image_paths 一致，每项格式同 get_all_text_with_positions
+        """
+        return list(self.ocr_batch(image_paths))
+
     def get_screen_text_for_ai(self, image_path):
         """
         获取屏幕文字信息的格式化输出，专门用于传递给AI
-        :param image_path: 截图路径
+        :param image_path: 截图路径，也可以是已解码的图片（同 get_all_text_with_positions）
         :return: 格式化的字符串，描述屏幕上的所有可见文字及位置
         """
         result = self.get_all_text_with_positions(image_path)
@@ -100,61 +284,64 @@ class ocr_service():
         if not result["elements"]:
             return "屏幕上未识别到任何文字"
         
-        # 按从上到下、从左到右的顺序排序
-        elements = sorted(result["elements"], key=lambda x: (x["bounds"]["top"], x["bounds"]["left"]))
+        # 按从上到下、从左到右的顺序排序（取出坐标后由 numpy 计算排列，lexsort 为稳定排序）
+        elements = result["elements"]
+        tops = np.fromiter((elem["bounds"]["top"] for elem in elements), dtype=np.int64, count=len(elements))
+        lefts = np.fromiter((elem["bounds"]["left"] for elem in elements), dtype=np.int64, count=len(elements))
+        elements = [elements[i] for i in np.lexsort((lefts, tops))]
         
-        lines = ["当前屏幕识别到的文字元素:"]
-        lines.append("-" * 50)
+        # 每个元素用一个模板生成，最后整体拼接
+        body = "\n".join(
+            f"{i}. \"{elem['text']}\"\n"
+            f"   坐标: 中心点({elem['center'][0]}, {elem['center'][1]})\n"
+            f"   区域: 左上({elem['bounds']['left']}, {elem['bounds']['top']}) 右下({elem['bounds']['right']}, {elem['bounds']['bottom']})\n"
+            f"   置信度: {elem['confidence']}"
+            for i, elem in enumerate(elements, 1)
+        )
+        separator = "-" * 50
         
-        for i, elem in enumerate(elements, 1):
-            lines.append(f"{i}. \"{elem['text']}\"")
-            lines.append(f"   坐标: 中心点({elem['center'][0]}, {elem['center'][1]})")
-            lines.append(f"   区域: 左上({elem['bounds']['left']}, {elem['bounds']['top']}) 右下({elem['bounds']['right']}, {elem['bounds']['bottom']})")
-            lines.append(f"   置信度: {elem['confidence']}")
-        
-        lines.append("-" * 50)
-        lines.append(f"共识别到 {len(elements)} 个文字元素")
-        
-        return "\n".join(lines)
+        return f"当前屏幕识别到的文字元素:\n{separator}\n{body}\n{separator}\n共识别到 {len(elements)} 个文字元素"
 
-    def get_position_from_ocr_by_paddle(self, image_path, target_str, contains_flag=True):
+    def get_position_from_ocr_by_paddle(self, image_path, target_str, contains_flag=True, roi=None,
+                                        early_stop=False):
         """
         从目标图片中查找目标文字的位置
-        :param image_path: 待查找图片
+        :param image_path: 待查找图片（路径或已解码的图片）
         :param target_str: 待查找文字
         :param contains_flag: 默认是包含查找，因为ocr有时候会识别不太准确
-        :return:
+        :param roi: 只识别的区域 (x, y, w, h)，已知目标所在区域时传入可大幅减少识别耗时
+        :param early_stop: 找到第一个匹配后立即返回（只需要一个位置时使用）
+        :return: 目标文字中心点坐标列表（相对整张图片）
         """
-        ocr = self.ocr_v3
         return_list = []
-        start_time = time.time()
-
-        # cv2
-        img = cv2.imread(image_path, 0)
+        offset_x, offset_y = roi[:2] if roi else (0, 0)
 
-        result = ocr.ocr(img, cls=False)[0]
+        result = self._run_ocr(image_path, roi)
         if contains_flag:
-            for line in result:
-                if target_str in line[-1][0]:
-                    return_list.append(((line[0][0][0] + line[0][1][0]) / 2, (line[0][0][1] + line[0][2][1]) / 2))
+            for box, (text, _) in result:
+                if target_str in text:
+                    return_list.append(((box[0][0] + box[1][0]) * 0.5 + offset_x,
+                                        (box[0][1] + box[2][1]) * 0.5 + offset_y))
+                    if early_stop:
+                        break
         else:
-            for line in result:
-                if target_str == line[-1][0]:
-                    return_list.append(((line[0][0][0] + line[0][1][0]) / 2, (line[0][0][1] + line[0][2][1]) / 2))
+            for box, (text, _) in result:
+                if target_str == text:
+                    return_list.append(((box[0][0] + box[1][0]) * 0.5 + offset_x,
+                                        (box[0][1] + box[2][1]) * 0.5 + offset_y))
+                    if early_stop:
+                        break
         return return_list
 
     def get_str(self, image_path, target_length=None):
         """
         根据图片解析图片中的文字，通常用作解验证码，仅在图片中找到一处文字时返回
-        :param image_path: 图片地址
+        :param image_path: 图片地址（或已解码的图片）
         :param target_length: 目标文字长度
         :return:
         """
-        ocr = self.ocr_v3
-        # cv2
-        img = cv2.imread(image_path, 0)
         try:
-            result = ocr.ocr(img, cls=False)[0]
+            result = self._run_ocr(image_path)
             if len(result) == 1:
                 if target_length:
                     return result[0][-1][0][-target_length:]
@@ -167,20 +354,43 @@ class ocr_service():
             return None
 
 
+# ---------------- OCR 独立进程 ----------------
+# 在子进程中加载模型并识别，避免 OCR 的 Python 后处理与主进程争抢 GIL
+_process_ocr = None
+
+
+def init_ocr_process():
+    """OCR 子进程初始化：加载一次模型，后续识别复用"""
+    global _process_ocr
+    _process_ocr = ocr_service()
+
+
+def ocr_process_ping():
+    """空任务，用于触发子进程启动和模型加载"""
+    return _process_ocr is not None
+
+
+def ocr_process_get_all_text_with_positions(image):
+    """在 OCR 子进程中识别图片（image 为灰度 numpy 数组，跨进程传递比 PIL 图像更小）"""
+    return _process_ocr.get_all_text_with_positions(image)
+
+
 if __name__ == "__main__":
     OCR = ocr_service()
-    start_time = time.time()
+    start_time = time.monotonic()
+    # 只解码一次，各测试共用
+    image = cv2.imread(r'./captcha.png', cv2.IMREAD_GRAYSCALE)
     
     # 测试获取所有文字及坐标
     print("=== 测试 get_all_text_with_positions ===")
-    result = OCR.get_all_text_with_positions(r'./captcha.png')
+    result = OCR.get_all_text_with_positions(image)
     print(result)
     
     print("\n=== 测试 get_screen_text_for_ai ===")
-    ai_text = OCR.get_screen_text_for_ai(r'./captcha.png')
+    ai_text = OCR.get_screen_text_for_ai(image)
     print(ai_text)
     
     print("\n=== 测试 get_position_from_ocr_by_paddle ===")
-    print(OCR.get_position_from_ocr_by_paddle(r'./captcha.png', "项目", True))
+    print(OCR.get_position_from_ocr_by_paddle(image, "项目", True))
     
-    print('\n总用时：', time.time() - start_time)
+    print('\n总用时：', time.monotonic() - start_time)
@@ -1,20 +1,28 @@
 import os
 import json
-import re
-from typing import Dict, Any, List, Optional
+import threading
+from typing import Dict, Any, List, Optional, Tuple
+
+try:
+    # Aho-Corasick 自动机：一次扫描任务文本即可找出所有出现的APP名称，未安装时逐个查找
+    import ahocorasick
+except ImportError:
+    ahocorasick = None
 
 
 class PresetService:
     """预设操作流程服务 - 按APP组织"""
     
-    _instance = None
-    _presets: Dict[str, Any] = {}
+    # 以下均为实例属性，由 _load_presets 设置（不使用类级别的可变默认值）
+    _presets: Dict[str, Any]
+    # 预设匹配索引：{包名: [(预设名, 小写预设名, 预设名长度, [(小写关键词, 关键词长度), ...]), ...]}
+    # 关键词按长度从长到短排列
+    _match_index: Dict[str, List[Tuple[str, str, int, List[Tuple[str, int]]]]]
+    # 预先生成的步骤文字：{包名: [(预设名, 步骤文字), ...]}
+    _rendered_steps: Dict[str, List[Tuple[str, str]]]
     
-    def __new__(cls):
-        if cls._instance is None:
-            cls._instance = super().__new__(cls)
-            cls._instance._load_presets()
-        return cls._instance
+    def __init__(self):
+        self._load_presets()
     
     def _load_presets(self):
         """加载预设配置文件"""
@@ -36,6 +44,67 @@ class PresetService:
         except Exception as e:
             print(f"加载预设配置失败: {e}")
             self._presets = {}
+        
+        # 以下内容只依赖预设，加载时一次性构建，重新加载时随之更新
+        self._presets_text_cache = {}  # {(包名, 推荐预设名): 格式化文字}
+        self._app_package_mapping = self._build_app_package_mapping()
+        self._formatted_packages = self._format_app_packages()
+        self._build_match_index()
+        self._build_app_matcher()
+        self._render_steps()
+    
+    def _build_match_index(self):
+        """预先把预设名和关键词转为小写并按长度降序排列，匹配任务时无需重复转换"""
+        self._match_index = {
+            package: [
+                (
+                    preset_name,
+                    preset_name.lower(),
+                    len(preset_name),
+                    sorted(
+                        ((keyword.lower(), len(keyword)) for keyword in preset_info.get('keywords', [])),
+                        key=lambda item: item[1],
+                        reverse=True
+                    )
+                )
+                for preset_name, preset_info in app_info.get('presets', {}).items()
+            ]
+            for package, app_info in self._presets.items()
+            if isinstance(app_info, dict)
+        }
+    
+    def _build_app_matcher(self):
+        """预先构建 APP 名称（小写）查找表，供 detect_target_app 使用"""
+        # 按映射顺序编号，多个名称同时出现时与逐个查找的结果一致（取映射中靠前的）
+        self._app_names = []
+        seen = set()
+        for app_name, package in self._app_package_mapping.items():
+            name_lower = app_name.lower()
+            if name_lower and name_lower not in seen:
+                seen.add(name_lower)
+                self._app_names.append((name_lower, package))
+        
+        self._app_automaton = None
+        if ahocorasick is not None and self._app_names:
+            automaton = ahocorasick.Automaton()
+            for order, (name_lower, package) in enumerate(self._app_names):
+                automaton.add_word(name_lower, (order, package))
+            automaton.make_automaton()
+            self._app_automaton = automaton
+    
+    def _render_steps(self):
+        """预先生成每个预设的步骤列表文字，格式化时只需拼接标题"""
+        self._rendered_steps = {
+            package: [
+                (
+                    preset_name,
+                    '\n'.join(f"    {i}. {step}" for i, step in enumerate(preset_info.get('steps', []), 1))
+                )
+                for preset_name, preset_info in app_info.get('presets', {}).items()
+            ]
+            for package, app_info in self._presets.items()
+            if isinstance(app_info, dict)
+        }
     
     def reload_presets(self):
         """重新加载预设配置"""
@@ -69,43 +138,52 @@ class PresetService:
         Returns:
             格式化的预设列表
         """
+        # 找出与任务最匹配的预设（如果有）
+        best_match_name = self._find_best_match(package_name, task) if task else None
+        
+        # 输出只取决于 APP 和推荐的预设，按二者缓存（重新加载预设时清空）
+        cache_key = (package_name, best_match_name)
+        text = self._presets_text_cache.get(cache_key)
+        if text is None:
+            text = self._format_app_presets(package_name, best_match_name)
+            self._presets_text_cache[cache_key] = text
+        return text
+    
+    def _format_app_presets(self, package_name: str, best_match_name: Optional[str]) -> str:
+        """生成某个APP的预设列表文字，best_match_name 为推荐的预设"""
         app_info = self._presets.get(package_name)
         
         if not app_info:
             return ""
         
         app_name = app_info.get('app_name', package_name)
-        presets = app_info.get('presets', {})
+        rendered_steps = self._rendered_steps.get(package_name)
         
-        if not presets:
+        if not rendered_steps:
             return ""
         
-        # 找出与任务最匹配的预设（如果有）
-        best_match_name = self._find_best_match(presets, task) if task else None
-        
-        lines = [f"【{app_name} 常用操作参考】"]
+        blocks = [f"【{app_name} 常用操作参考】"]
         
-        for preset_name, preset_info in presets.items():
+        for preset_name, steps_text in rendered_steps:
             # 如果是最佳匹配，添加推荐标记
             if preset_name == best_match_name:
-                lines.append(f"\n★ {preset_name}（推荐）:")
+                header = f"\n★ {preset_name}（推荐）:"
             else:
-                lines.append(f"\n• {preset_name}:")
+                header = f"\n• {preset_name}:"
             
-            steps = preset_info.get('steps', [])
-            for i, step in enumerate(steps, 1):
-                lines.append(f"    {i}. {step}")
+            # 步骤文字加载时已生成
+            blocks.append(f"{header}\n{steps_text}" if steps_text else header)
         
-        lines.append("\n（以上仅供参考，请根据实际屏幕内容灵活执行）")
+        blocks.append("\n（以上仅供参考，请根据实际屏幕内容灵活执行）")
         
-        return '\n'.join(lines)
+        return '\n'.join(blocks)
     
-    def _find_best_match(self, presets: Dict[str, Any], task: str) -> Optional[str]:
+    def _find_best_match(self, package_name: str, task: str) -> Optional[str]:
         """
-        在给定的预设中找出与任务最匹配的
+        在给定APP的预设中找出与任务最匹配的
         
         Args:
-            presets: 预设字典
+            package_name: APP包名
             task: 用户任务
             
         Returns:
@@ -118,18 +196,19 @@ class PresetService:
         best_name = None
         best_score = 0
         
-        for preset_name, preset_info in presets.items():
+        for preset_name, name_lower, name_len, keywords in self._match_index.get(package_name, ()):
             score = 0
-            keywords = preset_info.get('keywords', [])
             
-            # 关键词匹配
-            for keyword in keywords:
-                if keyword.lower() in task_lower:
-                    score += len(keyword)
+            # 关键词匹配：长关键词优先，命中的文字替换掉，避免"微信支付"和"支付"重复计分
+            remaining = task_lower
+            for keyword_lower, keyword_len in keywords:
+                if keyword_lower in remaining:
+                    score += keyword_len
+                    remaining = remaining.replace(keyword_lower, '\0', 1)
             
             # 预设名称匹配
-            if preset_name.lower() in task_lower:
-                score += len(preset_name)
+            if name_lower in task_lower:
+                score += name_len
             
             if score > best_score:
                 best_score = score
@@ -150,11 +229,12 @@ class PresetService:
         """
         task_lower = task.lower()
         
-        # 从动态映射中查找
-        mapping = self.get_app_package_mapping()
+        if self._app_automaton is not None:
+            matches = [value for _, value in self._app_automaton.iter(task_lower)]
+            return min(matches)[1] if matches else None
         
-        for app_name, package in mapping.items():
-            if app_name.lower() in task_lower:
+        for name_lower, package in self._app_names:
+            if name_lower in task_lower:
                 return package
         
         return None
@@ -188,12 +268,16 @@ class PresetService:
     
     def get_app_package_mapping(self) -> Dict[str, str]:
         """
-        获取 APP 名称到包名的映射
+        获取 APP 名称到包名的映射（加载预设时构建，调用方不要修改）
         用于 AI 启动应用时查找包名
         
         Returns:
             {app_name: package_name} 映射字典
         """
+        return self._app_package_mapping
+    
+    def _build_app_package_mapping(self) -> Dict[str, str]:
+        """根据预设构建 APP 名称到包名的映射"""
         mapping = {}
         
         for package, info in self._presets.items():
@@ -213,15 +297,31 @@ class PresetService:
     
     def format_app_packages_for_ai(self) -> str:
         """
-        格式化 APP 包名列表，供 AI 启动应用时参考
+        格式化 APP 包名列表，供 AI 启动应用时参考（加载预设时生成）
         
         Returns:
             格式化的 APP 包名列表字符串
         """
-        mapping = self.get_app_package_mapping()
-        
+        return self._formatted_packages
+    
+    def _format_app_packages(self) -> str:
+        """生成 APP 包名列表字符串"""
         lines = []
-        for app_name, package in sorted(mapping.items(), key=lambda x: x[0]):
+        for app_name, package in sorted(self._app_package_mapping.items(), key=lambda x: x[0]):
             lines.append(f"  {app_name}: {package}")
         
-        return '\n'.join(lines)
\ No newline at end of file
+        return '\n'.join(lines)
+
+
+_instance: Optional[PresetService] = None
+_instance_lock = threading.Lock()
+
+
+def get_preset_service() -> PresetService:
+    """获取预设服务单例（首次使用时加载预设，加锁保证并发首次访问只加载一次）"""
+    global _instance
+    if _instance is None:
+        with _instance_lock:
+            if _instance is None:
+                _instance = PresetService()
+    return _instance
@@ -3,27 +3,41 @@
 通过二维码配对和 mDNS 服务发现实现
 """
 
+import atexit
 import subprocess
 import threading
-import time
 import base64
-from io import BytesIO
-from random import randint
+from functools import lru_cache
+from secrets import randbelow
 from shutil import which
 from typing import Optional, Dict, Any, Callable
 from dataclasses import dataclass
 from enum import Enum
 
+import numpy as np
 from zeroconf import IPVersion, ServiceBrowser, ServiceInfo, ServiceListener, Zeroconf
 
+try:
+    # 模块加载时导入一次，生成二维码时无需再走导入流程
+    from qrcode import QRCode
+    from qrcode.constants import ERROR_CORRECT_M
+except ImportError:
+    QRCode = None
+
+from app.services import adb_host
+
 
 # ================= 常量 =================
 PAIR_TYPE = "_adb-tls-pairing._tcp.local."
+# 配对服务已由配对阶段的 ServiceBrowser 监听，这里不再重复监听
 CONNECT_TYPES = [
     "_adb._tcp.local.",
     "_adb-tls-connect._tcp.local.",
-    "_adb-tls-pairing._tcp.local.",
 ]
+PAIR_NAME = "debug"
+# adb 配对/连接超时（秒），局域网内超过这个时间基本已经失败
+PAIR_TIMEOUT = 10
+CONNECT_TIMEOUT = 5
 SUCCESS_PAIR = "Successfully paired"
 SUCCESS_CONNECT = "connected to"
 
@@ -42,6 +56,20 @@ class WirelessStatus(Enum):
     TIMEOUT = "timeout"
 
 
+# 会话仍在进行中的状态
+ACTIVE_STATUSES = frozenset({
+    WirelessStatus.WAITING_SCAN,
+    WirelessStatus.PAIRING,
+    WirelessStatus.PAIR_SUCCESS,
+    WirelessStatus.CONNECTING,
+})
+# 超时时视为配对未完成的状态
+PAIRING_STATUSES = frozenset({
+    WirelessStatus.WAITING_SCAN,
+    WirelessStatus.PAIRING,
+})
+
+
 @dataclass
 class WirelessSession:
     """无线调试会话"""
@@ -64,7 +92,14 @@ class ADBWirelessListener(ServiceListener):
         self.on_status_change = on_status_change
         self.paired_ip: Optional[str] = None
         self.connect_browsers = []
-        self._stopped = False
+        # 停止监听（手动停止或连接成功）时置位，超时线程据此提前退出
+        self._stopped = threading.Event()
+        # 多个 ServiceBrowser 在各自线程中回调，同一设备只发起一次连接
+        self._connect_lock = threading.Lock()
+        self._connecting = False
+        self._connected = False
+        # 已尝试连接过的 (IP, 端口)，同一地址被多种服务类型公布时只连接一次
+        self._attempted: set = set()
     
     def _update_status(self, status: WirelessStatus, message: str = ""):
         """更新状态"""
@@ -75,29 +110,47 @@ class ADBWirelessListener(ServiceListener):
     
     def stop(self):
         """停止监听"""
-        self._stopped = True
+        self._stopped.set()
+    
+    def close(self):
+        """停止监听并取消连接阶段创建的服务浏览器（会等待浏览器线程结束，不能在回调中调用）"""
+        self.stop()
+        for browser in self.connect_browsers:
+            try:
+                browser.cancel()
+            except Exception:
+                pass
+        self.connect_browsers = []
+    
+    def wait_stopped(self, timeout: float) -> bool:
+        """等待监听停止，返回是否在超时前停止"""
+        return self._stopped.wait(timeout)
     
     def remove_service(self, zc: Zeroconf, type_: str, name: str) -> None:
         pass
 
     def add_service(self, zc: Zeroconf, type_: str, name: str) -> None:
-        if self._stopped:
+        if self._stopped.is_set():
+            return
+        
+        # 先按类型和名称过滤，无关的服务不查询详细信息（get_service_info 需要额外的 mDNS 查询）
+        if type_ == PAIR_TYPE:
+            if self.paired_ip or name != f"{self.session.name}.{PAIR_TYPE}":
+                return
+        elif not self.paired_ip or type_ not in CONNECT_TYPES or self._connected:
             return
             
         info: ServiceInfo | None = zc.get_service_info(type_, name)
         if not info:
             return
 
-        ip_addresses = info.ip_addresses_by_version(IPVersion.All)
+        ip_addresses = info.ip_addresses_by_version(IPVersion.V4Only)
         if not ip_addresses:
             return
         ip_address = ip_addresses[0].exploded
 
         # ========== 配对阶段 ==========
-        if type_ == PAIR_TYPE and name == f"{self.session.name}.{PAIR_TYPE}":
-            if self.paired_ip:
-                return
-
+        if type_ == PAIR_TYPE:
             self._update_status(WirelessStatus.PAIRING, f"正在配对 {ip_address}:{info.port}")
             
             if self._pair(info, ip_address):
@@ -115,27 +168,38 @@ class ADBWirelessListener(ServiceListener):
             return
 
         # ========== 连接阶段 ==========
-        if self.paired_ip and ip_address == self.paired_ip and type_ in CONNECT_TYPES:
-            self._update_status(WirelessStatus.CONNECTING, f"正在连接 {ip_address}:{info.port}")
-            self._connect(ip_address, info.port)
+        if ip_address == self.paired_ip:
+            key = (ip_address, info.port)
+            with self._connect_lock:
+                if self._connected or self._connecting or key in self._attempted:
+                    return
+                self._attempted.add(key)
+                self._connecting = True
+            try:
+                self._update_status(WirelessStatus.CONNECTING, f"正在连接 {ip_address}:{info.port}")
+                self._connected = self._connect(ip_address, info.port)
+            finally:
+                self._connecting = False
 
     def update_service(self, zc: Zeroconf, type_: str, name: str) -> None:
         pass
 
     def _pair(self, info: ServiceInfo, ip_address: str) -> bool:
         """执行配对"""
-        cmd = f"adb pair {ip_address}:{info.port} {self.session.password}"
+        cmd = [WirelessService._adb_path, "pair", f"{ip_address}:{info.port}", str(self.session.password)]
         try:
             process = subprocess.run(
-                cmd.split(" "), 
-                capture_output=True, 
-                timeout=30
+                cmd,
+                capture_output=True,
+                text=True,
+                encoding="utf-8",
+                errors="ignore",
+                timeout=PAIR_TIMEOUT
             )
-            stdout = process.stdout.decode(errors="ignore")
-            stderr = process.stderr.decode(errors="ignore")
+            stdout = process.stdout
 
             if process.returncode != 0:
-                self._update_status(WirelessStatus.PAIR_FAILED, f"配对失败: {stderr or stdout}")
+                self._update_status(WirelessStatus.PAIR_FAILED, f"配对失败: {process.stderr or stdout}")
                 return False
 
             if SUCCESS_PAIR in stdout:
@@ -150,33 +214,44 @@ class ADBWirelessListener(ServiceListener):
             self._update_status(WirelessStatus.PAIR_FAILED, f"配对异常: {str(e)}")
             return False
 
-    def _connect(self, ip: str, port: int):
-        """执行连接"""
-        cmd = f"adb connect {ip}:{port}"
+    def _connect(self, ip: str, port: int) -> bool:
+        """执行连接（直接向 adb server 发送 host:connect 请求，adb server 不可用时再启动 adb 进程）"""
         try:
-            process = subprocess.run(
-                cmd.split(" "), 
-                capture_output=True, 
-                timeout=30
-            )
-            stdout = process.stdout.decode(errors="ignore")
+            try:
+                stdout = adb_host.host_request(f"host:connect:{ip}:{port}", timeout=CONNECT_TIMEOUT)
+            except adb_host.AdbHostError as e:
+                stdout = str(e)
+            except ConnectionError:
+                process = subprocess.run(
+                    [WirelessService._adb_path, "connect", f"{ip}:{port}"],
+                    stdout=subprocess.PIPE,
+                    stderr=subprocess.DEVNULL,
+                    text=True,
+                    encoding="utf-8",
+                    errors="ignore",
+                    timeout=CONNECT_TIMEOUT
+                )
+                stdout = process.stdout
 
             if SUCCESS_CONNECT in stdout:
                 self.session.device_port = port
                 self._update_status(WirelessStatus.CONNECTED, f"成功连接到 {ip}:{port}")
-                self._stopped = True
-            else:
-                self._update_status(WirelessStatus.CONNECT_FAILED, f"连接失败: {stdout}")
-        except subprocess.TimeoutExpired:
+                self._stopped.set()
+                return True
+            self._update_status(WirelessStatus.CONNECT_FAILED, f"连接失败: {stdout}")
+        except (subprocess.TimeoutExpired, TimeoutError):
             self._update_status(WirelessStatus.CONNECT_FAILED, "连接超时")
         except Exception as e:
             self._update_status(WirelessStatus.CONNECT_FAILED, f"连接异常: {str(e)}")
+        return False
 
 
 class WirelessService:
     """无线调试服务"""
     
     _instance = None
+    # adb 可执行文件的绝对路径（首次检查时查找 PATH 后缓存）
+    _adb_path: Optional[str] = None
     
     def __new__(cls):
         if cls._instance is None:
@@ -189,42 +264,84 @@ class WirelessService:
             return
         self._initialized = True
         self._session: Optional[WirelessSession] = None
+        # Zeroconf 实例在进程内一直复用（首次配对时创建，退出时关闭），每次会话只创建/取消服务浏览器
         self._zeroconf: Optional[Zeroconf] = None
+        self._pair_browser: Optional[ServiceBrowser] = None
         self._listener: Optional[ADBWirelessListener] = None
         self._thread: Optional[threading.Thread] = None
         self._status_callback: Optional[Callable] = None
+        # 多个请求可能同时开始/停止配对，会话状态的切换需要加锁
+        self._lock = threading.Lock()
+        
+        # 提前在后台启动 adb server，配对/连接时无需再等待其启动
+        if self.check_adb():
+            try:
+                subprocess.Popen(
+                    [self._adb_path, "start-server"],
+                    stdout=subprocess.DEVNULL,
+                    stderr=subprocess.DEVNULL
+                )
+            except OSError as e:
+                print(f"启动 adb server 失败: {e}")
+        
+        # 后台预先生成一次二维码（qrcode 内部的编码表等首次使用时才加载），首次配对请求无需等待
+        threading.Thread(target=self._warm_up_qr, name='qr-warmup', daemon=True).start()
     
-    @staticmethod
-    def check_adb() -> bool:
-        """检查 adb 是否可用"""
-        return which("adb") is not None
-    
-    def _generate_qr_base64(self, name: str, password: int) -> str:
-        """生成二维码的 Base64 编码"""
+    def _warm_up_qr(self):
         try:
-            from qrcode import QRCode
-            from qrcode.constants import ERROR_CORRECT_M
-            
-            qr_data = f"WIFI:T:ADB;S:{name};P:{password};;"
-            
-            qr = QRCode(
-                version=1,
-                error_correction=ERROR_CORRECT_M,
-                box_size=10,
-                border=4,
-            )
-            qr.add_data(qr_data)
-            qr.make(fit=True)
-            
-            img = qr.make_image(fill_color="black", back_color="white")
-            
-            buffer = BytesIO()
-            img.save(buffer, format='PNG')
-            img_base64 = base64.b64encode(buffer.getvalue()).decode('utf-8')
-            
-            return f"data:image/png;base64,{img_base64}"
-        except ImportError:
-            raise Exception("需要安装 qrcode 库: pip install qrcode[pil]")
+            self._generate_qr_base64(PAIR_NAME, 0)
+        except Exception:
+            pass
+    
+    @classmethod
+    def check_adb(cls) -> bool:
+        """检查 adb 是否可用（找到后缓存路径，不再重复遍历 PATH）"""
+        if cls._adb_path is None:
+            cls._adb_path = which("adb")
+        return cls._adb_path is not None
+    
+    @classmethod
+    def refresh_adb_path(cls) -> bool:
+        """重新查找 adb（例如程序运行期间才安装了 adb）"""
+        cls._adb_path = None
+        return cls.check_adb()
+    
+    @staticmethod
+    @lru_cache(maxsize=16)
+    def _generate_qr_base64(name: str, password: int) -> str:
+        """生成二维码的 Base64 编码（SVG 格式，无需 PNG 压缩编码，相同配对信息直接复用）"""
+        if QRCode is None:
+            raise Exception("需要安装 qrcode 库: pip install qrcode")
+        
+        qr_data = f"WIFI:T:ADB;S:{name};P:{password};;"
+        
+        qr = QRCode(
+            version=1,
+            error_correction=ERROR_CORRECT_M,
+            border=4,
+        )
+        qr.add_data(qr_data)
+        qr.make(fit=True)
+        
+        # 模块矩阵（含边框）按行找出连续的黑色块，每段输出一个矩形路径，不逐个模块绘制
+        matrix = np.asarray(qr.get_matrix(), dtype=np.int8)
+        size = matrix.shape[0]
+        edges = np.diff(np.pad(matrix, ((0, 0), (1, 1))), axis=1)
+        rows, starts = np.nonzero(edges == 1)
+        ends = np.nonzero(edges == -1)[1]
+        path = ''.join(
+            f"M{x},{y}h{w}v1h-{w}z"
+            for x, y, w in zip(starts.tolist(), rows.tolist(), (ends - starts).tolist())
+        )
+        
+        # 矢量图只是一段文字，前端 <img> 会缩放到固定尺寸显示
+        svg = (
+            f'<svg xmlns="http://www.w3.org/2000/svg" viewBox="0 0 {size} {size}" shape-rendering="crispEdges">'
+            f'<rect width="{size}" height="{size}" fill="#fff"/><path d="{path}"/></svg>'
+        )
+        img_base64 = base64.b64encode(svg.encode('utf-8')).decode('utf-8')
+        
+        return f"data:image/svg+xml;base64,{img_base64}"
     
     def start_pairing(self, timeout: int = 120) -> Dict[str, Any]:
         """
@@ -236,6 +353,11 @@ class WirelessService:
         Returns:
             包含二维码和会话信息的字典
         """
+        with self._lock:
+            return self._start_pairing(timeout)
+    
+    def _start_pairing(self, timeout: int) -> Dict[str, Any]:
+        """开始配对流程（调用方已持有 self._lock）"""
         # 检查 adb
         if not self.check_adb():
             return {
@@ -244,11 +366,12 @@ class WirelessService:
             }
         
         # 停止之前的会话
-        self.stop_pairing()
+        self._stop_pairing()
         
         # 生成配对信息
-        name = "debug"
-        password = randint(100000, 999999)
+        name = PAIR_NAME
+        # 使用系统随机源生成配对码，局域网内无法根据之前的配对码推测
+        password = 100000 + randbelow(900000)
         
         try:
             qr_base64 = self._generate_qr_base64(name, password)
@@ -269,28 +392,34 @@ class WirelessService:
         
         # 启动 mDNS 监听
         try:
-            self._zeroconf = Zeroconf()
+            zeroconf = self._get_zeroconf()
             self._listener = ADBWirelessListener(
-                self._zeroconf, 
+                zeroconf, 
                 self._session,
                 self._status_callback
             )
             
             # 开始监听配对服务
-            ServiceBrowser(self._zeroconf, PAIR_TYPE, self._listener)
+            self._pair_browser = ServiceBrowser(zeroconf, PAIR_TYPE, self._listener)
+            
+            # 启动超时线程（监听停止后立即退出，不会一直占用线程到超时）
+            listener = self._listener
             
-            # 启动超时线程
             def timeout_handler():
-                time.sleep(timeout)
-                if self._session and self._session.status in [
-                    WirelessStatus.WAITING_SCAN, 
-                    WirelessStatus.PAIRING
-                ]:
-                    self._session.status = WirelessStatus.TIMEOUT
-                    self._session.message = "配对超时"
-                    if self._status_callback:
-                        self._status_callback(self._session)
-                    self.stop_pairing()
+                if listener.wait_stopped(timeout):
+                    return
+                with self._lock:
+                    if self._listener is not listener:
+                        return
+                    session = self._session
+                    if not session or session.status not in PAIRING_STATUSES:
+                        return
+                    session.status = WirelessStatus.TIMEOUT
+                    session.message = "配对超时"
+                    self._stop_pairing()
+                # 回调在释放锁之后执行，回调耗时不会阻塞开始/停止配对
+                if self._status_callback:
+                    self._status_callback(session)
             
             self._thread = threading.Thread(target=timeout_handler, daemon=True)
             self._thread.start()
@@ -304,7 +433,7 @@ class WirelessService:
             }
             
         except Exception as e:
-            self.stop_pairing()
+            self._stop_pairing()
             return {
                 'success': False,
                 'message': f'启动配对服务失败: {str(e)}'
@@ -328,29 +457,51 @@ class WirelessService:
     
     def stop_pairing(self):
         """停止配对流程"""
-        if self._listener:
-            self._listener.stop()
-            self._listener = None
+        with self._lock:
+            self._stop_pairing()
+    
+    def _stop_pairing(self):
+        """停止配对流程（调用方已持有 self._lock，没有会话时直接返回）"""
+        if self._pair_browser is None and self._listener is None and self._session is None:
+            return
         
-        if self._zeroconf:
+        if self._pair_browser:
             try:
-                self._zeroconf.close()
+                self._pair_browser.cancel()
             except Exception:
                 pass
-            self._zeroconf = None
+            self._pair_browser = None
+        
+        if self._listener:
+            self._listener.close()
+            self._listener = None
         
         self._session = None
     
+    def _get_zeroconf(self) -> Zeroconf:
+        """获取共用的 Zeroconf 实例（调用方已持有 self._lock）"""
+        if self._zeroconf is None:
+            # 只使用 IPv4：adb pair/connect 的 "IP:端口" 参数本身不支持 IPv6 地址，也不必查询 AAAA 记录
+            self._zeroconf = Zeroconf(ip_version=IPVersion.V4Only)
+            atexit.register(self._close_zeroconf)
+        return self._zeroconf
+    
+    def _close_zeroconf(self):
+        """程序退出时关闭 Zeroconf"""
+        with self._lock:
+            self._stop_pairing()
+            if self._zeroconf:
+                try:
+                    self._zeroconf.close()
+                except Exception:
+                    pass
+                self._zeroconf = None
+    
     def set_status_callback(self, callback: Callable):
         """设置状态变化回调"""
         self._status_callback = callback
     
     def is_active(self) -> bool:
         """检查是否有活动会话"""
-        return self._session is not None and self._session.status in [
-            WirelessStatus.WAITING_SCAN,
-            WirelessStatus.PAIRING,
-            WirelessStatus.PAIR_SUCCESS,
-            WirelessStatus.CONNECTING
-        ]
+        return self._session is not None and self._session.status in ACTIVE_STATUSES
 
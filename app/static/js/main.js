@@ -6,7 +6,10 @@ class AIPhoneAssistant {
     constructor() {
         this.isConnected = false;
         this.isExecuting = false;
+        this.currentSessionId = null;  // 当前任务会话ID（用于停止任务）
+        this.deviceScreenSize = null;  // 设备实际分辨率（任务推送的是缩小的预览图时由后端提供）
         this.screenRefreshInterval = null;
+        this.screenObjectUrl = null;  // 当前截图的 Blob URL（刷新时释放旧的）
         this.wirelessPollingInterval = null;
         this.currentTab = 'usb';
         
@@ -397,7 +400,11 @@ class AIPhoneAssistant {
 
     async stopExecution() {
         try {
-            await fetch('/api/chat/stop', { method: 'POST' });
+            await fetch('/api/chat/stop', {
+                method: 'POST',
+                headers: { 'Content-Type': 'application/json' },
+                body: JSON.stringify({ session_id: this.currentSessionId })
+            });
             this.showToast('正在停止...', 'warning');
         } catch (error) {
             console.error('停止失败:', error);
@@ -482,20 +489,21 @@ class AIPhoneAssistant {
         
         if (!img.naturalWidth || !img.naturalHeight) return;
         
-        const isLandscape = img.naturalWidth > img.naturalHeight;
+        const { width, height } = this.getDeviceScreenSize();
+        const isLandscape = width > height;
         
         // 更新手机框架样式
         if (isLandscape) {
             phoneFrame.classList.add('landscape');
             devicePanel.classList.add('landscape-device');
             if (orientationBadge) {
-                orientationBadge.textContent = `横屏 ${img.naturalWidth}×${img.naturalHeight}`;
+                orientationBadge.textContent = `横屏 ${width}×${height}`;
             }
         } else {
             phoneFrame.classList.remove('landscape');
             devicePanel.classList.remove('landscape-device');
             if (orientationBadge) {
-                orientationBadge.textContent = `竖屏 ${img.naturalWidth}×${img.naturalHeight}`;
+                orientationBadge.textContent = `竖屏 ${width}×${height}`;
             }
         }
         
@@ -527,10 +535,14 @@ class AIPhoneAssistant {
         }
         
         try {
-            const response = await fetch('/api/device/screenshot');
-            const data = await response.json();
-            if (data.success) {
-                this.deviceScreen.src = data.data;
+            // 直接获取截图二进制（设备端编码的 JPEG，失败时为 PNG），避免 base64 编解码
+            const response = await fetch('/api/device/screenshot?format=raw');
+            if (response.ok) {
+                const blob = await response.blob();
+                if (this.screenObjectUrl) URL.revokeObjectURL(this.screenObjectUrl);
+                this.screenObjectUrl = URL.createObjectURL(blob);
+                this.deviceScreenSize = null;
+                this.deviceScreen.src = this.screenObjectUrl;
                 // 图片加载后会自动触发 onload -> updateScreenOrientation
             }
         } catch (error) {
@@ -543,6 +555,12 @@ class AIPhoneAssistant {
         this.refreshScreen();
     }
 
+    getDeviceScreenSize() {
+        // 预览图可能被缩小，坐标换算以设备实际分辨率为准
+        if (this.deviceScreenSize) return this.deviceScreenSize;
+        return { width: this.deviceScreen.naturalWidth, height: this.deviceScreen.naturalHeight };
+    }
+
     stopScreenRefresh() {
         // 保留方法但不做任何操作（已移除定时刷新）
     }
@@ -552,8 +570,9 @@ class AIPhoneAssistant {
         
         // 使用图片的实际显示区域来计算坐标
         const imgRect = this.deviceScreen.getBoundingClientRect();
-        const scaleX = this.deviceScreen.naturalWidth / imgRect.width;
-        const scaleY = this.deviceScreen.naturalHeight / imgRect.height;
+        const screenSize = this.getDeviceScreenSize();
+        const scaleX = screenSize.width / imgRect.width;
+        const scaleY = screenSize.height / imgRect.height;
         
         // 计算相对于图片的点击位置
         const relX = e.clientX - imgRect.left;
@@ -629,8 +648,9 @@ class AIPhoneAssistant {
         
         // 获取屏幕缩放比例
         const rect = this.deviceScreen.getBoundingClientRect();
-        const scaleX = rect.width / this.deviceScreen.naturalWidth;
-        const scaleY = rect.height / this.deviceScreen.naturalHeight;
+        const screenSize = this.getDeviceScreenSize();
+        const scaleX = rect.width / screenSize.width;
+        const scaleY = rect.height / screenSize.height;
         
         if (type === 'click') {
             this._showClickMarker(params.x * scaleX, params.y * scaleY);
@@ -814,21 +834,38 @@ class AIPhoneAssistant {
         } catch (error) {
             this.addSystemMessage('❌ 执行出错: ' + error.message, 'error');
         } finally {
+            this.currentSessionId = null;
             this.setExecutingState(false);
             // 不自动刷新，截图已通过 SSE 流式返回
         }
     }
 
     handleStepResult(data) {
-        // 更新截图
-        if (data.screenshot) {
-            this.deviceScreen.src = data.screenshot;
+        // 合并推送的多个事件，按顺序逐个处理
+        if (data.type === 'step') {
+            data.events.forEach(event => this.handleStepResult(event));
+            return;
+        }
+        
+        // 更新截图（Agent 只推送截图ID，图片按需从接口拉取）
+        const screenshotSrc = data.screenshot_id
+            ? `/api/device/screenshot/${data.screenshot_id}`
+            : data.screenshot;
+        if (screenshotSrc) {
+            this.deviceScreenSize = data.screen_size
+                ? { width: data.screen_size[0], height: data.screen_size[1] }
+                : null;
+            this.deviceScreen.src = screenshotSrc;
             // 截图更新时清除之前的操作标记
             this.clearActionMarkers();
             // 图片加载后会自动触发 onload -> updateScreenOrientation
         }
         
         switch (data.type) {
+            case 'session':
+                // 记录任务会话ID，停止时只停止当前页面发起的任务
+                this.currentSessionId = data.session_id;
+                break;
             case 'start':
             case 'info':
             case 'update':
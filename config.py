@@ -1,8 +1,15 @@
 import os
 from dotenv import load_dotenv
 
-# 加载.env文件
-load_dotenv()
+# 加载.env文件（只在首次加载时读取，子进程/重载进程继承环境变量后不再重复解析）
+if not os.environ.get('_AIDUT_ENV_LOADED'):
+    load_dotenv()
+    os.environ['_AIDUT_ENV_LOADED'] = '1'
+
+
+def env_bool(name: str, default: str = '') -> bool:
+    """读取布尔型环境变量（true/1/yes 为真，不区分大小写），所有开关类环境变量都通过这里读取"""
+    return os.getenv(name, default).strip().lower() in ('true', '1', 'yes')
 
 
 class Config:
@@ -10,13 +17,20 @@ class Config:
     
     # Flask配置
     SECRET_KEY = os.getenv('SECRET_KEY', 'your-secret-key-here')
-    DEBUG = os.getenv('DEBUG', 'True').lower() == 'true'
+    DEBUG = env_bool('DEBUG', 'True')
     
     # 大模型配置
     LLM_API_KEY = os.getenv('LLM_API_KEY', '')
     LLM_BASE_URL = os.getenv('LLM_BASE_URL', 'https://api.openai.com/v1')
     LLM_MODEL = os.getenv('LLM_MODEL', 'gpt-4o')
+    # 是否为系统提示词添加 cache_control 标记（Anthropic 兼容接口的提示词缓存）
+    LLM_PROMPT_CACHE = env_bool('LLM_PROMPT_CACHE', 'False')
+    # AI 决策缓存是否写入 SQLite（进程重启后仍可复用），以及持久化条目的有效期（秒）
+    LLM_RESPONSE_CACHE_PERSIST = env_bool('LLM_RESPONSE_CACHE_PERSIST', 'True')
+    LLM_RESPONSE_CACHE_TTL = int(os.getenv('LLM_RESPONSE_CACHE_TTL') or 86400)
     
     # 设备配置
     DEVICE_SERIAL = os.getenv('DEVICE_SERIAL', '')
-
+    
+    # OCR 是否在独立子进程中执行
+    OCR_USE_PROCESS = env_bool('OCR_USE_PROCESS', 'False')
@@ -3,7 +3,10 @@ AI手机助手 - 启动文件
 """
 from app import create_app
 
-app = create_app()
+# OCR 子进程（spawn）会以 __mp_main__ 的名义重新导入本文件，子进程中不创建应用，
+# 否则各路由模块的服务单例（设备、大模型、缓存、无线调试等）都会在子进程中再初始化一遍
+if __name__ != '__mp_main__':
+    app = create_app()
 
 if __name__ == '__main__':
     print("=" * 50)
@@ -13,9 +16,22 @@ if __name__ == '__main__':
     print("📌 请确保已连接Android设备并开启USB调试")
     print("=" * 50)
     
-    app.run(
-        host='0.0.0.0',
-        port=5000,
-        debug=app.config.get('DEBUG', True)
-    )
+    debug = app.config.get('DEBUG', True)
+    
+    try:
+        from waitress import serve
+    except ImportError:
+        serve = None
+    
+    if serve is not None and not debug:
+        # 非调试模式使用 waitress：线程池处理请求，SSE 任务流与状态轮询互不阻塞
+        serve(app, host='0.0.0.0', port=5000, threads=8, connection_limit=200)
+    else:
+        # threaded=True: 每个 SSE 任务流独占一个线程，不会阻塞状态轮询等其他请求
+        app.run(
+            host='0.0.0.0',
+            port=5000,
+            debug=debug,
+            threaded=True
+        )
 